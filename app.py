@@ -1,15 +1,39 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context, send_from_directory, g
 import os
 import json
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+import time
+import sqlite3
+import heapq
+import bisect
+import functools
+import itertools
+from array import array
+import threading
+import uuid
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import csv
+import zipfile
+import gzip
+import mmap
+import struct
+import zlib
+from contextlib import closing
+from xml.sax.saxutils import escape as xml_escape
 from google.oauth2.service_account import Credentials
 import gspread
 import qrcode
-from io import BytesIO
+from io import BytesIO, StringIO
 import base64
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
+from photo_worker import process_photo
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -27,6 +51,54 @@ class Config:
     GOOGLE_CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
     GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID')
     BASE_URL = os.getenv('BASE_URL', 'https://example.com')
+    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///requests.db')
+    
+    # Несколько клиентов (организаций) в одном приложении
+    TENANTS_FILE = os.getenv('TENANTS_FILE', 'tenants.json')
+    TENANT_POOL_SIZE = int(os.getenv('TENANT_POOL_SIZE', '100'))
+    TENANT_IDLE_SECONDS = int(os.getenv('TENANT_IDLE_SECONDS', '1800'))
+    SHEETS_RETRY_SECONDS = int(os.getenv('SHEETS_RETRY_SECONDS', '60'))
+    EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '500'))
+    
+    # Архив старых заявок
+    ARCHIVE_FOLDER = os.getenv('ARCHIVE_FOLDER', 'archive')
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '180'))
+    
+    # Фото к заявкам
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+    MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', '20'))
+    PHOTO_MAX_SIZE = int(os.getenv('PHOTO_MAX_SIZE', '1600'))
+    PHOTO_QUALITY = int(os.getenv('PHOTO_QUALITY', '80'))
+    PHOTO_WORKERS = int(os.getenv('PHOTO_WORKERS', '2'))
+    
+    # Панель диспетчера (Server-Sent Events)
+    EVENTS_HISTORY = int(os.getenv('EVENTS_HISTORY', '100'))
+    EVENTS_RETENTION = int(os.getenv('EVENTS_RETENTION', '10000'))
+    EVENTS_POLL_SECONDS = float(os.getenv('EVENTS_POLL_SECONDS', '1'))
+    SSE_KEEPALIVE_SECONDS = int(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+    EVENTS_MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', '20'))
+    
+    # Контроль допуска (на один воркер): общая ёмкость и лимиты эндпоинтов
+    ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY', '8'))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '5'))
+    ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '5'))
+    SUBMIT_MAX_IN_FLIGHT = int(os.getenv('SUBMIT_MAX_IN_FLIGHT', '8'))
+    SUBMIT_MAX_QUEUE = int(os.getenv('SUBMIT_MAX_QUEUE', '32'))
+    QR_MAX_IN_FLIGHT = int(os.getenv('QR_MAX_IN_FLIGHT', '2'))
+    QR_MAX_QUEUE = int(os.getenv('QR_MAX_QUEUE', '8'))
+    
+    # Запись трафика для нагрузочных тестов (пусто - выключена)
+    CAPTURE_FILE = os.getenv('CAPTURE_FILE', '')
+    CAPTURE_SALT = os.getenv('CAPTURE_SALT', '')
+    
+    # Локальные заглушки Telegram и Google Sheets (только для тестовых стендов)
+    STANDIN_INTEGRATIONS = os.getenv('STANDIN_INTEGRATIONS', 'false').lower() == 'true'
+    STANDIN_TELEGRAM_MS = int(os.getenv('STANDIN_TELEGRAM_MS', '300'))
+    STANDIN_SHEETS_MS = int(os.getenv('STANDIN_SHEETS_MS', '800'))
+    
+    # Список помещений (CSV: number,building,floor,type,name)
+    ROOMS_FILE = os.getenv('ROOMS_FILE', 'rooms.csv')
+    ROOMS_CHECK_SECONDS = int(os.getenv('ROOMS_CHECK_SECONDS', '30'))
     
     # Типы проблем
     PROBLEM_TYPES = {
@@ -50,14 +122,72 @@ class Config:
         'CORRIDOR': 'Коридор',
         'LOBBY': 'Холл'
     }
+    
+    # Статусы заявок (первый - статус новой заявки)
+    TICKET_STATUSES = ['Новая', 'В работе', 'Выполнена']
+    
+    # Срок реакции на заявку по типу проблемы, в минутах
+    SLA_MINUTES = {
+        'soap': 240,
+        'paper': 240,
+        'trash': 240,
+        'cleaning': 240,
+        'plumbing': 120,
+        'electricity': 120,
+        'heating': 120,
+        'other': 480
+    }
+    SLA_ENABLED = os.getenv('SLA_ENABLED', 'true').lower() == 'true'
+    
+    # Важность проблем для очереди уведомлений
+    PROBLEM_SEVERITY = {
+        'soap': 'low',
+        'paper': 'low',
+        'trash': 'normal',
+        'cleaning': 'normal',
+        'plumbing': 'high',
+        'electricity': 'high',
+        'heating': 'high',
+        'other': 'normal'
+    }
+    # Допустимая задержка в очереди по уровню важности, в секундах:
+    # несрочная заявка обгоняет срочную, если ждёт дольше на эту разницу
+    SEVERITY_DELAYS = {
+        'high': 0,
+        'normal': 60,
+        'low': 300
+    }
+    NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '2'))
+    NOTIFY_WAIT_SECONDS = float(os.getenv('NOTIFY_WAIT_SECONDS', '10'))
+    NOTIFY_MAX_QUEUE = int(os.getenv('NOTIFY_MAX_QUEUE', '500'))
+    SLA_RETRY_MINUTES = int(os.getenv('SLA_RETRY_MINUTES', '5'))
+    
+    def __init__(self):
+        # Переопределение сроков: SLA_OVERRIDES=plumbing:60,heating:90
+        overrides = os.getenv('SLA_OVERRIDES', '')
+        self.SLA_MINUTES = dict(self.SLA_MINUTES)
+        for item in filter(None, (part.strip() for part in overrides.split(','))):
+            key, _, minutes = item.partition(':')
+            self.SLA_MINUTES[key.strip()] = int(minutes)
+        
+        # Переопределение важности: SEVERITY_OVERRIDES=soap:normal,other:high
+        overrides = os.getenv('SEVERITY_OVERRIDES', '')
+        self.PROBLEM_SEVERITY = dict(self.PROBLEM_SEVERITY)
+        for item in filter(None, (part.strip() for part in overrides.split(','))):
+            key, _, severity = item.partition(':')
+            if severity.strip() not in self.SEVERITY_DELAYS:
+                raise ValueError(f"Unknown severity in SEVERITY_OVERRIDES: {item}")
+            self.PROBLEM_SEVERITY[key.strip()] = severity.strip()
 
 config = Config()
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_UPLOAD_MB * 1024 * 1024
 
 class TelegramBot:
     def __init__(self, token, chat_id):
         self.token = token
         self.chat_id = chat_id
         self.base_url = f"https://api.telegram.org/bot{token}"
+        self.session = requests.Session()
     
     def send_message(self, message):
         """Отправка сообщения в Telegram"""
@@ -73,13 +203,39 @@ class TelegramBot:
         }
         
         try:
-            response = requests.post(url, data=data, timeout=10)
+            response = self.session.post(url, data=data, timeout=10)
             response.raise_for_status()
             logger.info("Message sent to Telegram successfully")
             return True
         except requests.RequestException as e:
             logger.error(f"Failed to send Telegram message: {e}")
             return False
+    
+    def send_photo(self, photo_path, caption=''):
+        """Отправка фото в Telegram"""
+        if not self.token or not self.chat_id:
+            logger.warning("Telegram credentials not configured")
+            return False
+            
+        url = f"{self.base_url}/sendPhoto"
+        data = {
+            'chat_id': self.chat_id,
+            'caption': caption,
+            'parse_mode': 'HTML'
+        }
+        
+        try:
+            with open(photo_path, 'rb') as photo:
+                response = self.session.post(url, data=data, files={'photo': photo}, timeout=30)
+            response.raise_for_status()
+            logger.info("Photo sent to Telegram successfully")
+            return True
+        except (requests.RequestException, OSError) as e:
+            logger.error(f"Failed to send Telegram photo: {e}")
+            return False
+    
+    def close(self):
+        self.session.close()
 
 class GoogleSheetsIntegration:
     def __init__(self, credentials_file, sheet_id):
@@ -115,7 +271,7 @@ class GoogleSheetsIntegration:
     def _setup_headers(self):
         """Настройка заголовков таблицы"""
         headers = ['Дата', 'Время', 'Корпус', 'Этаж', 'Тип помещения', 
-                  'Номер', 'Проблема', 'Описание', 'Статус']
+                  'Номер', 'Проблема', 'Описание', 'Статус', 'Фото']
         
         try:
             # Проверяем, есть ли уже заголовки
@@ -132,28 +288,1760 @@ class GoogleSheetsIntegration:
             return False
             
         try:
-            row = [
-                request_data['date'],
-                request_data['time'],
-                request_data['room']['building'],
-                request_data['room']['floor'],
-                request_data['room']['type'],
-                request_data['room']['number'],
-                request_data['problem_type'],
-                request_data['description'],
-                'Новая'
-            ]
-            
-            self.worksheet.insert_row(row, 2)  # Вставляем после заголовков
+            self.worksheet.insert_row(self._request_row(request_data), 2)  # Вставляем после заголовков
             logger.info("Request added to Google Sheets successfully")
             return True
         except Exception as e:
             logger.error(f"Failed to add request to Google Sheets: {e}")
             return False
+    
+    def _request_row(self, request_data):
+        return [
+            request_data['date'],
+            request_data['time'],
+            request_data['room']['building'],
+            request_data['room']['floor'],
+            request_data['room']['type'],
+            request_data['room']['number'],
+            request_data['problem_type'],
+            request_data['description'],
+            'Новая',
+            request_data.get('photo_url', '')
+        ]
+    
+    def insert_requests(self, groups):
+        """Вставка заявок в несколько мест таблицы одним запросом batch_update.
+
+        groups - {номер строки: [данные заявок]}. Вставки идут снизу вверх,
+        чтобы строки из одной группы не сдвигали место следующей; запрос
+        выполняется целиком или не выполняется совсем.
+        """
+        if not self.worksheet:
+            logger.warning("Google Sheets not initialized")
+            return False
+        if not groups:
+            return True
+
+        sheet_id = self.worksheet.id
+        requests_body = []
+        for row in sorted(groups, reverse=True):
+            rows = [self._request_row(data) for data in groups[row]]
+            requests_body.append({'insertDimension': {
+                'range': {'sheetId': sheet_id, 'dimension': 'ROWS',
+                          'startIndex': row - 1, 'endIndex': row - 1 + len(rows)},
+                'inheritFromBefore': False
+            }})
+            requests_body.append({'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': row - 1, 'columnIndex': 0},
+                'rows': [{'values': [{'userEnteredValue': {'stringValue': '' if value is None else str(value)}}
+                                     for value in values]} for values in rows],
+                'fields': 'userEnteredValue'
+            }})
+        try:
+            self.worksheet.spreadsheet.batch_update({'requests': requests_body})
+            count = sum(len(requests_data) for requests_data in groups.values())
+            logger.info(f"{count} requests inserted into Google Sheets successfully")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to insert requests into Google Sheets: {e}")
+            return False
+    
+    def iter_rows(self, page_size=1000, pages_per_call=5):
+        """Чтение строк заявок сверху вниз страницами через batch_get.
+
+        За один запрос к API читается pages_per_call диапазонов по page_size
+        строк. Выдаёт списки (номер строки, значения); чтение прекращается,
+        когда таблица заканчивается или генератор закрыт.
+        """
+        if not self.worksheet:
+            raise RuntimeError("Google Sheets not initialized")
+        start = 2  # первая строка после заголовков
+        while True:
+            ranges = [f"A{start + i * page_size}:J{start + (i + 1) * page_size - 1}"
+                      for i in range(pages_per_call)]
+            for offset, values in enumerate(self.worksheet.batch_get(ranges)):
+                first_row = start + offset * page_size
+                if not values:
+                    return
+                yield [(first_row + i, row) for i, row in enumerate(values)]
+                if len(values) < page_size:
+                    return
+            start += page_size * pages_per_call
+    
+    def close(self):
+        session = getattr(self.client, 'session', None)
+        if session is not None:
+            session.close()
+
+class StandInTelegramBot:
+    """Заглушка Telegram для тестового стенда: ничего не отправляет, имитирует задержку"""
+
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000
+
+    def send_message(self, message):
+        time.sleep(self.latency)
+        return True
+
+    def send_photo(self, photo_path, caption=''):
+        time.sleep(self.latency)
+        return True
+
+    def close(self):
+        pass
+
+class StandInSheets:
+    """Заглушка Google Sheets для тестового стенда: ничего не пишет, имитирует задержку"""
+
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000
+
+    def add_request(self, request_data):
+        time.sleep(self.latency)
+        return True
+
+    def insert_requests(self, groups):
+        time.sleep(self.latency)
+        return True
+
+    def iter_rows(self, page_size=1000, pages_per_call=5):
+        return iter(())
+
+    def close(self):
+        pass
+
+class TicketStore:
+    """Локальный журнал заявок (SQLite)"""
+
+    # Фильтр запроса -> колонка таблицы
+    FILTERS = {
+        'building': 'building',
+        'room_type': 'room_type',
+        'problem': 'problem_key',
+        'status': 'status',
+        'room': 'room_number',
+        'tenant': 'tenant'
+    }
+
+    # Колонки, добавленные после создания таблицы
+    MIGRATIONS = {
+        'escalated_at': 'TEXT',
+        'photo': 'TEXT',
+        'tenant': "TEXT NOT NULL DEFAULT 'default'",
+        'sheet_status': "TEXT NOT NULL DEFAULT 'Новая'"  # статус в Google Sheets при последней сверке
+    }
+
+    def __init__(self, database_url):
+        if database_url.startswith('sqlite:///'):
+            database_url = database_url[len('sqlite:///'):]
+        self.path = database_url
+        self._initialize()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _initialize(self):
+        """Создание таблицы заявок"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS tickets (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        created_at TEXT NOT NULL,
+                        date TEXT NOT NULL,
+                        time TEXT NOT NULL,
+                        building TEXT,
+                        floor TEXT,
+                        room_type TEXT,
+                        room_number TEXT,
+                        problem_key TEXT,
+                        problem_type TEXT,
+                        description TEXT,
+                        status TEXT NOT NULL DEFAULT 'Новая',
+                        telegram_sent INTEGER NOT NULL DEFAULT 0,
+                        sheets_saved INTEGER NOT NULL DEFAULT 0,
+                        escalated_at TEXT,
+                        photo TEXT,
+                        tenant TEXT NOT NULL DEFAULT 'default'
+                    )
+                ''')
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(tickets)')}
+                for column, column_type in self.MIGRATIONS.items():
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE tickets ADD COLUMN {column} {column_type}')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON tickets (created_at)')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS watermarks (
+                        name TEXT NOT NULL,
+                        tenant TEXT NOT NULL,
+                        value INTEGER NOT NULL,
+                        updated_at TEXT NOT NULL,
+                        PRIMARY KEY (name, tenant)
+                    )
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        tenant TEXT NOT NULL,
+                        type TEXT NOT NULL,
+                        data TEXT NOT NULL
+                    )
+                ''')
+            logger.info(f"Ticket store initialized: {self.path}")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to initialize ticket store: {e}")
+
+    def add_ticket(self, request_data, problem_key, tenant_id):
+        """Сохранение заявки, возвращает её номер"""
+        room = request_data['room']
+        try:
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute(
+                    'INSERT INTO tickets (created_at, date, time, building, floor, room_type, '
+                    'room_number, problem_key, problem_type, description, photo, tenant) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (request_data['timestamp'], request_data['date'], request_data['time'],
+                     str(room.get('building', '')), str(room.get('floor', '')),
+                     str(room.get('type', '')), str(room.get('number', '')),
+                     problem_key, request_data['problem_type'], request_data['description'],
+                     request_data.get('photo'), tenant_id))
+                return cursor.lastrowid
+        except sqlite3.Error as e:
+            logger.error(f"Failed to store ticket: {e}")
+            return None
+
+    def mark_delivery(self, ticket_id, telegram_sent, sheets_saved):
+        """Отметка о доставке заявки в Telegram и Google Sheets"""
+        if ticket_id is None:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute('UPDATE tickets SET telegram_sent = ?, sheets_saved = ? WHERE id = ?',
+                             (int(telegram_sent), int(sheets_saved), ticket_id))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update ticket {ticket_id}: {e}")
+
+    def mark_delivered(self, ticket_ids, column):
+        """Отметка о доставке нескольких заявок (column: telegram_sent или sheets_saved)"""
+        if column not in ('telegram_sent', 'sheets_saved'):
+            raise ValueError(f"Unknown delivery column: {column}")
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(f'UPDATE tickets SET {column} = 1 WHERE id = ?',
+                             [(ticket_id,) for ticket_id in ticket_ids])
+
+    def update_status(self, ticket_id, status, tenant_id):
+        """Изменение статуса заявки, возвращает заявку до изменения (None если не найдена)"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                ticket = conn.execute('SELECT * FROM tickets WHERE id = ? AND tenant = ?',
+                                      (ticket_id, tenant_id)).fetchone()
+                if ticket is not None:
+                    conn.execute('UPDATE tickets SET status = ? WHERE id = ?', (status, ticket_id))
+                return ticket
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update status of ticket {ticket_id}: {e}")
+            return None
+
+    def set_sheet_status(self, ticket_id, status):
+        """Статус, выставленный в Google Sheets: меняет статус заявки и запоминает
+        значение из таблицы. Возвращает заявку до изменения (None если не найдена)"""
+        with closing(self._connect()) as conn, conn:
+            ticket = conn.execute('SELECT * FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+            if ticket is not None:
+                conn.execute('UPDATE tickets SET status = ?, sheet_status = ? WHERE id = ?',
+                             (status, status, ticket_id))
+            return ticket
+
+    def oldest_open_ticket(self, tenant_id, closed_status, date_from=None):
+        """Самая старая заявка клиента не в статусе closed_status (начиная с date_from)"""
+        query = 'SELECT * FROM tickets WHERE tenant = ? AND status != ?'
+        params = [tenant_id, closed_status]
+        if date_from:
+            query += ' AND created_at >= ?'
+            params.append(date_from.isoformat())
+        with closing(self._connect()) as conn:
+            return conn.execute(query + ' ORDER BY created_at LIMIT 1', params).fetchone()
+
+    def iter_unescalated(self, status):
+        """Заявки в статусе status, по которым ещё не было эскалации"""
+        with closing(self._connect()) as conn:
+            yield from conn.execute(
+                'SELECT id, created_at, problem_key FROM tickets '
+                'WHERE status = ? AND escalated_at IS NULL', (status,))
+
+    def claim_escalation(self, ticket_id, status):
+        """Атомарно помечает заявку как эскалированную.
+
+        Возвращает заявку, если она всё ещё в статусе status и не была
+        эскалирована другим процессом, иначе None.
+        """
+        try:
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute(
+                    'UPDATE tickets SET escalated_at = ? '
+                    'WHERE id = ? AND status = ? AND escalated_at IS NULL',
+                    (datetime.now().isoformat(), ticket_id, status))
+                if cursor.rowcount == 0:
+                    return None
+                return conn.execute('SELECT * FROM tickets WHERE id = ?', (ticket_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to claim escalation of ticket {ticket_id}: {e}")
+            return None
+
+    def release_escalation(self, ticket_id):
+        """Снятие отметки об эскалации (если напоминание не отправилось)"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute('UPDATE tickets SET escalated_at = NULL WHERE id = ?', (ticket_id,))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to release escalation of ticket {ticket_id}: {e}")
+
+    def get_tickets(self, ticket_ids, chunk_size=500):
+        """Заявки по номерам (запросами по chunk_size номеров)"""
+        ticket_ids = list(ticket_ids)
+        tickets = []
+        with closing(self._connect()) as conn:
+            for i in range(0, len(ticket_ids), chunk_size):
+                chunk = ticket_ids[i:i + chunk_size]
+                placeholders = ', '.join('?' * len(chunk))
+                tickets.extend(conn.execute(
+                    f'SELECT * FROM tickets WHERE id IN ({placeholders}) ORDER BY id', chunk))
+        return tickets
+
+    def archive_months(self, tenant_id, status, date_to):
+        """Число заявок в статусе status старше date_to по месяцам (ГГГГ-ММ)"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute('''
+                SELECT substr(created_at, 1, 7) AS month, COUNT(*) AS count FROM tickets
+                WHERE tenant = ? AND status = ? AND created_at < ?
+                GROUP BY month ORDER BY month
+            ''', (tenant_id, status, date_to.isoformat())).fetchall()
+        return [(row['month'], row['count']) for row in rows]
+
+    def move_tickets(self, tenant_id, status, date_from, date_to, writer):
+        """Удаление заявок в статусе status за период с передачей их в writer.
+
+        Выборка, удаление и writer выполняются в одной транзакции с блокировкой
+        записи: пока writer работает, другие процессы не могут изменить статус,
+        а при ошибке writer журнал остаётся без изменений. Возвращает число заявок.
+        """
+        params = (tenant_id, status, date_from.isoformat(), date_to.isoformat())
+        where = 'tenant = ? AND status = ? AND created_at >= ? AND created_at < ?'
+        with closing(self._connect()) as conn:
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                tickets = [dict(row) for row in
+                           conn.execute(f'SELECT * FROM tickets WHERE {where} ORDER BY created_at, id', params)]
+                if tickets:
+                    conn.execute(f'DELETE FROM tickets WHERE {where}', params)
+                    writer(tickets)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return len(tickets)
+
+    def vacuum(self):
+        with closing(self._connect()) as conn:
+            conn.execute('VACUUM')
+
+    def get_watermark(self, name, tenant_id):
+        """Номер последней обработанной заявки для фоновой задачи name"""
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT value FROM watermarks WHERE name = ? AND tenant = ?',
+                               (name, tenant_id)).fetchone()
+        return row['value'] if row else 0
+
+    def set_watermark(self, name, tenant_id, value):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO watermarks (name, tenant, value, updated_at) '
+                         'VALUES (?, ?, ?, ?)', (name, tenant_id, value, datetime.now().isoformat()))
+
+    def first_ticket_after(self, ticket_id, tenant_id):
+        """Первая заявка клиента с номером больше ticket_id"""
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT * FROM tickets WHERE id > ? AND tenant = ? ORDER BY id LIMIT 1',
+                                (ticket_id, tenant_id)).fetchone()
+
+    def add_event(self, tenant_id, event_type, data, retention):
+        """Запись события для панели диспетчера, возвращает его номер"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute('INSERT INTO events (tenant, type, data) VALUES (?, ?, ?)',
+                                      (tenant_id, event_type, json.dumps(data, ensure_ascii=False)))
+                event_id = cursor.lastrowid
+                # Журнал событий нужен только для досылки - старые удаляем
+                if event_id % 1000 == 0:
+                    conn.execute('DELETE FROM events WHERE id <= ?', (event_id - retention,))
+                return event_id
+        except sqlite3.Error as e:
+            logger.error(f"Failed to store event: {e}")
+            return None
+
+    def events_after(self, event_id, limit):
+        """События с номером больше event_id (не более limit последних)"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT id, tenant, type, data FROM events WHERE id > ? ORDER BY id DESC LIMIT ?',
+                (event_id, limit)).fetchall()
+        return [tuple(row) for row in reversed(rows)]
+
+    def iter_tickets(self, date_from=None, date_to=None, chunk_size=500, **filters):
+        """Постраничная выборка заявок (по chunk_size строк) по возрастанию даты"""
+        clauses, params = [], []
+        if date_from:
+            clauses.append('created_at >= ?')
+            params.append(date_from.isoformat())
+        if date_to:
+            clauses.append('created_at < ?')
+            params.append(date_to.isoformat())
+        for name, value in filters.items():
+            if value:
+                clauses.append(f'{self.FILTERS[name]} = ?')
+                params.append(value)
+
+        query = 'SELECT * FROM tickets'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY created_at, id'
+
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+class TicketArchive:
+    """Архив старых заявок: сжатые сегменты по месяцам с индексом.
+
+    Файлы лежат в <папка>/<клиент>/<ГГГГ-ММ>/segment-NNNNNN.*. Сегмент
+    (.jsonl.gz) - последовательность gzip-блоков по BLOCK_SIZE заявок,
+    каждый блок распаковывается отдельно. Индекс (.idx) читается через
+    mmap: отсортированные записи (дата, crc32 номера помещения, номер
+    блока) и смещения блоков. Запрос открывает только месяцы из диапазона
+    дат и распаковывает только блоки, найденные по индексу.
+    """
+
+    BLOCK_SIZE = 256
+    MAGIC = b'WCIX'
+    HEADER = struct.Struct('<4sHII')  # магия, версия, число записей, число блоков
+    RECORD = struct.Struct('<III')    # дата ГГГГММДД, crc32 номера помещения, номер блока
+    OFFSET = struct.Struct('<Q')
+
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def partition_of(created_at):
+        return created_at[:7]  # ГГГГ-ММ
+
+    @staticmethod
+    def _date_key(created_at):
+        return int(created_at[:10].replace('-', ''))
+
+    @staticmethod
+    def _room_key(room_number):
+        return zlib.crc32(str(room_number or '').encode('utf-8'))
+
+    def _partition_dir(self, tenant_id, partition):
+        return os.path.join(self.root, tenant_id, partition)
+
+    def write_segment(self, tenant_id, partition, tickets):
+        """Запись заявок одного месяца (по возрастанию даты) в новый сегмент; возвращает путь без расширения"""
+        directory = self._partition_dir(tenant_id, partition)
+        os.makedirs(directory, exist_ok=True)
+        existing = [name for name in os.listdir(directory) if name.endswith('.idx')]
+        base = os.path.join(directory, f"segment-{len(existing) + 1:06d}")
+
+        records, offsets, block = [], [], []
+        with open(f"{base}.jsonl.gz.tmp", 'wb') as f:
+            def flush_block():
+                offsets.append(f.tell())
+                f.write(gzip.compress(''.join(block).encode('utf-8'), mtime=0))
+                block.clear()
+
+            for ticket in tickets:
+                records.append((self._date_key(ticket['created_at']),
+                                self._room_key(ticket['room_number']), len(offsets)))
+                block.append(json.dumps(ticket, ensure_ascii=False) + '\n')
+                if len(block) >= self.BLOCK_SIZE:
+                    flush_block()
+            if block:
+                flush_block()
+            offsets.append(f.tell())
+            f.flush()
+            os.fsync(f.fileno())
+
+        records.sort()
+        with open(f"{base}.idx.tmp", 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, 1, len(records), len(offsets) - 1))
+            for record in records:
+                f.write(self.RECORD.pack(*record))
+            for offset in offsets:
+                f.write(self.OFFSET.pack(offset))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Сегмент виден читателям только после появления индекса
+        os.replace(f"{base}.jsonl.gz.tmp", f"{base}.jsonl.gz")
+        os.replace(f"{base}.idx.tmp", f"{base}.idx")
+        return base
+
+    @staticmethod
+    def remove_segment(base):
+        """Удаление сегмента, записанного write_segment (сначала индекс, чтобы его не видели читатели)"""
+        for suffix in ('.idx', '.jsonl.gz'):
+            try:
+                os.remove(f"{base}{suffix}")
+            except FileNotFoundError:
+                pass
+
+    def _partitions(self, tenant_id, date_from, date_to):
+        directory = os.path.join(self.root, tenant_id)
+        if not os.path.isdir(directory):
+            return []
+        first = date_from.strftime('%Y-%m') if date_from else None
+        last = (date_to - timedelta(microseconds=1)).strftime('%Y-%m') if date_to else None
+        return [partition for partition in sorted(os.listdir(directory))
+                if (first is None or partition >= first) and (last is None or partition <= last)]
+
+    def _segment_blocks(self, index_path, date_from, date_to, room_key):
+        """Номера блоков сегмента и их смещения по индексу"""
+        with open(index_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            magic, _, count, block_count = self.HEADER.unpack_from(index, 0)
+            if magic != self.MAGIC:
+                raise ValueError(f"Invalid archive index: {index_path}")
+
+            def date_at(position):
+                return self.RECORD.unpack_from(index, self.HEADER.size + position * self.RECORD.size)[0]
+
+            def lower_bound(date):
+                low, high = 0, count
+                while low < high:
+                    middle = (low + high) // 2
+                    if date_at(middle) < date:
+                        low = middle + 1
+                    else:
+                        high = middle
+                return low
+
+            start = lower_bound(self._date_key(date_from.isoformat())) if date_from else 0
+            end = count
+            if date_to:
+                # date_to не включается, но может быть внутри дня - берём день целиком
+                end = lower_bound(self._date_key((date_to + timedelta(days=1)).isoformat()))
+
+            blocks = set()
+            for position in range(start, end):
+                _, room, block = self.RECORD.unpack_from(
+                    index, self.HEADER.size + position * self.RECORD.size)
+                if room_key is None or room == room_key:
+                    blocks.add(block)
+
+            offsets_start = self.HEADER.size + count * self.RECORD.size
+            return [(self.OFFSET.unpack_from(index, offsets_start + block * self.OFFSET.size)[0],
+                     self.OFFSET.unpack_from(index, offsets_start + (block + 1) * self.OFFSET.size)[0])
+                    for block in sorted(blocks)]
+
+    def iter_tickets(self, tenant_id, date_from=None, date_to=None, chunk_size=500, **filters):
+        """Заявки из архива (по chunk_size) с теми же фильтрами, что TicketStore"""
+        conditions = {TicketStore.FILTERS[name]: str(value)
+                      for name, value in filters.items() if value and name != 'tenant'}
+        room_key = self._room_key(conditions['room_number']) if 'room_number' in conditions else None
+        low = date_from.isoformat() if date_from else None
+        high = date_to.isoformat() if date_to else None
+
+        chunk = []
+        for partition in self._partitions(tenant_id, date_from, date_to):
+            directory = self._partition_dir(tenant_id, partition)
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith('.idx'):
+                    continue
+                blocks = self._segment_blocks(os.path.join(directory, name), date_from, date_to, room_key)
+                if not blocks:
+                    continue
+                with open(os.path.join(directory, name[:-len('.idx')] + '.jsonl.gz'), 'rb') as segment:
+                    for start, end in blocks:
+                        segment.seek(start)
+                        lines = gzip.decompress(segment.read(end - start)).decode('utf-8').splitlines()
+                        for line in lines:
+                            ticket = json.loads(line)
+                            if low and ticket['created_at'] < low or high and ticket['created_at'] >= high:
+                                continue
+                            if any(str(ticket.get(column)) != value for column, value in conditions.items()):
+                                continue
+                            chunk.append(ticket)
+                            if len(chunk) >= chunk_size:
+                                yield chunk
+                                chunk = []
+        if chunk:
+            yield chunk
+
+class SLAScheduler:
+    """Контроль сроков реакции на новые заявки.
+
+    Открытые заявки хранятся в куче по дедлайну, фоновый поток спит до
+    ближайшего дедлайна. Снятые с контроля заявки удаляются лениво: запись
+    в куче игнорируется, если её дедлайн не совпадает с _pending.
+    """
+
+    def __init__(self, store, bot_for, sla_minutes, status, retry_minutes=5):
+        self.store = store
+        self.bot_for = bot_for  # tenant_id -> TelegramBot
+        self.sla_minutes = sla_minutes
+        self.status = status
+        self.retry_delay = timedelta(minutes=retry_minutes)
+        self._heap = []
+        self._pending = {}  # ticket_id -> дедлайн
+        self._condition = threading.Condition()
+        self._thread = None
+        self.on_escalated = None  # вызывается с заявкой после отправки напоминания
+
+    def deadline_for(self, problem_key, created_at):
+        minutes = self.sla_minutes.get(problem_key, self.sla_minutes.get('other'))
+        return created_at + timedelta(minutes=minutes)
+
+    def start(self):
+        """Загрузка открытых заявок из журнала и запуск фонового потока"""
+        try:
+            for ticket in self.store.iter_unescalated(self.status):
+                created_at = datetime.fromisoformat(ticket['created_at'])
+                self._pending[ticket['id']] = self.deadline_for(ticket['problem_key'], created_at)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load open tickets for SLA: {e}")
+        self._heap = [(deadline, ticket_id) for ticket_id, deadline in self._pending.items()]
+        heapq.heapify(self._heap)
+
+        self._thread = threading.Thread(target=self._run, name='sla-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"SLA scheduler started with {len(self._heap)} open tickets")
+
+    def schedule(self, ticket_id, deadline):
+        """Поставить заявку на контроль (или перенести дедлайн)"""
+        if self._thread is None:
+            return  # контроль выключен: очередь некому разбирать
+        with self._condition:
+            self._pending[ticket_id] = deadline
+            heapq.heappush(self._heap, (deadline, ticket_id))
+            if self._heap[0] == (deadline, ticket_id):
+                self._condition.notify()
+
+    def discard(self, ticket_id):
+        """Снять заявку с контроля"""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._pending.pop(ticket_id, None)
+
+    def _next_due(self):
+        """Ожидание ближайшего просроченного дедлайна"""
+        with self._condition:
+            while True:
+                while self._heap and self._pending.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, ticket_id = self._heap[0]
+                timeout = (deadline - datetime.now()).total_seconds()
+                if timeout <= 0:
+                    heapq.heappop(self._heap)
+                    del self._pending[ticket_id]
+                    return ticket_id
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            ticket_id = self._next_due()
+            try:
+                self._escalate(ticket_id)
+            except Exception as e:
+                logger.error(f"Failed to escalate ticket {ticket_id}: {e}")
+
+    def _escalate(self, ticket_id):
+        ticket = self.store.claim_escalation(ticket_id, self.status)
+        if ticket is None:
+            return
+
+        minutes = self.sla_minutes.get(ticket['problem_key'], self.sla_minutes.get('other'))
+        message = f"""
+⏰ <b>Заявка №{ticket['id']} не обработана вовремя</b>
+
+📍 <b>Помещение:</b> Корпус {ticket['building']}, {ticket['floor']} этаж, {ticket['room_type']} №{ticket['room_number']}
+🔧 <b>Проблема:</b> {ticket['problem_type']}
+📅 <b>Создана:</b> {ticket['date']} {ticket['time']}
+⌛ <b>Срок реакции:</b> {minutes} мин
+
+#просрочено #помещение{ticket['room_number']}
+        """.strip()
+
+        bot = self.bot_for(ticket['tenant'])
+        if bot is not None and bot.send_message(message):
+            logger.info(f"Ticket {ticket_id} escalated")
+            if self.on_escalated is not None:
+                self.on_escalated(ticket)
+        else:
+            self.store.release_escalation(ticket_id)
+            self.schedule(ticket_id, datetime.now() + self.retry_delay)
+
+class PhotoProcessor:
+    """Фото к заявкам: сохранение загрузки, обработка и отправка в Telegram"""
+
+    def __init__(self, upload_folder, max_size, quality, workers):
+        self.upload_folder = os.path.abspath(upload_folder)
+        self.raw_folder = os.path.join(self.upload_folder, 'raw')
+        self.max_size = max_size
+        self.quality = quality
+        self.workers = workers
+        self._process_pool = None
+        self._delivery_pool = None
+        self._lock = threading.Lock()
+
+    def _pools(self):
+        # Пулы создаются лениво - уже после форка воркеров gunicorn
+        with self._lock:
+            if self._process_pool is None:
+                # fork из многопоточного воркера может унаследовать захваченные блокировки,
+                # поэтому процессы запускаются через forkserver; в нём заранее загружен
+                # только модуль обработки фото, а не всё приложение
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['photo_worker'])
+                self._process_pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            if self._delivery_pool is None:
+                self._delivery_pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                         thread_name_prefix='photo-delivery')
+        return self._process_pool, self._delivery_pool
+
+    def _drop_process_pool(self, pool):
+        """Замена пула после падения процесса: сломанный пул больше не принимает задачи"""
+        with self._lock:
+            if self._process_pool is pool:
+                self._process_pool = None
+        pool.shutdown(wait=False)
+
+    def save_upload(self, file_storage):
+        """Сохранение загруженного файла на диск, возвращает имя фото"""
+        os.makedirs(self.raw_folder, exist_ok=True)
+        name = uuid.uuid4().hex
+        file_storage.save(os.path.join(self.raw_folder, name))
+        return name
+
+    def discard(self, name):
+        """Удаление сохранённой загрузки, которая не будет обработана"""
+        try:
+            os.remove(os.path.join(self.raw_folder, name))
+        except FileNotFoundError:
+            pass
+
+    def filename(self, name):
+        return f"{name}.jpg"
+
+    def url(self, name, base_url):
+        return f"{base_url}/photos/{self.filename(name)}"
+
+    def submit(self, name, caption, bot):
+        """Фоновая обработка фото и отправка в Telegram"""
+        _, delivery_pool = self._pools()
+        delivery_pool.submit(self._deliver, name, caption, bot)
+
+    def _deliver(self, name, caption, bot):
+        raw_path = os.path.join(self.raw_folder, name)
+        target_path = os.path.join(self.upload_folder, self.filename(name))
+        process_pool, _ = self._pools()
+        try:
+            process_pool.submit(process_photo, raw_path, target_path,
+                                self.max_size, self.quality).result()
+            bot.send_photo(target_path, caption)
+        except BrokenProcessPool as e:
+            # Процесс упал (например, закончилась память на огромном фото); фото,
+            # которые обрабатывались в этом пуле, теряются, следующие пойдут в новый пул
+            logger.error(f"Photo process pool broke while processing {name}: {e}")
+            self._drop_process_pool(process_pool)
+        except Exception as e:
+            logger.error(f"Failed to process photo {name}: {e}")
+        finally:
+            self.discard(name)
+
+class Tenant:
+    """Клиент (организация) со своей таблицей и Telegram-ботом"""
+
+    def __init__(self, tenant_id, telegram_bot_token=None, telegram_chat_id=None,
+                 google_credentials_file=None, google_sheet_id=None, base_url=None, hosts=(),
+                 rooms_file=None):
+        self.id = tenant_id
+        self.telegram_bot_token = telegram_bot_token
+        self.telegram_chat_id = telegram_chat_id
+        self.google_credentials_file = google_credentials_file or config.GOOGLE_CREDENTIALS_FILE
+        self.google_sheet_id = google_sheet_id
+        self.base_url = base_url
+        self.hosts = list(hosts)
+        self.rooms_file = rooms_file or config.ROOMS_FILE
+
+class TenantRegistry:
+    """Настройки клиентов и определение клиента по хосту или префиксу URL.
+
+    Клиенты читаются из JSON-файла TENANTS_FILE. Если файла нет, работает
+    один клиент 'default' с настройками из переменных окружения. Если файл
+    есть, но его не удалось прочитать, приложение не запускается: иначе все
+    заявки ушли бы в бот и таблицу клиента по умолчанию.
+    """
+
+    DEFAULT_TENANT = 'default'
+
+    def __init__(self, tenants_file):
+        self.tenants = {}
+        self.hosts = {}
+        if os.path.exists(tenants_file):
+            try:
+                with open(tenants_file, encoding='utf-8') as f:
+                    for tenant_id, settings in json.load(f).items():
+                        self.add(Tenant(tenant_id, **settings))
+                if not self.tenants:
+                    raise ValueError("no tenants defined")
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Failed to load tenants file {tenants_file}: {e}")
+                raise ValueError(f"Invalid tenants file {tenants_file}: {e}") from e
+            logger.info(f"Loaded {len(self.tenants)} tenants from {tenants_file}")
+        else:
+            self.add(Tenant(self.DEFAULT_TENANT,
+                            telegram_bot_token=config.TELEGRAM_BOT_TOKEN,
+                            telegram_chat_id=config.TELEGRAM_CHAT_ID,
+                            google_credentials_file=config.GOOGLE_CREDENTIALS_FILE,
+                            google_sheet_id=config.GOOGLE_SHEET_ID,
+                            base_url=config.BASE_URL))
+
+    def add(self, tenant):
+        self.tenants[tenant.id] = tenant
+        for host in tenant.hosts:
+            self.hosts[host.lower()] = tenant
+
+    def get(self, tenant_id):
+        return self.tenants.get(tenant_id)
+
+    def resolve(self, host, prefix_tenant_id=None):
+        """Клиент по префиксу URL, затем по хосту, иначе клиент по умолчанию"""
+        if prefix_tenant_id is not None:
+            return self.tenants.get(prefix_tenant_id)
+        tenant = self.hosts.get((host or '').split(':')[0].lower())
+        return tenant or self.tenants.get(self.DEFAULT_TENANT)
+
+class TenantIntegrations:
+    """Авторизованные клиенты Telegram и Google Sheets одного клиента"""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        if config.STANDIN_INTEGRATIONS:
+            logger.warning(f"Using stand-in Telegram and Google Sheets for tenant {tenant.id}")
+            self.telegram_bot = StandInTelegramBot(config.STANDIN_TELEGRAM_MS)
+            self.google_sheets = StandInSheets(config.STANDIN_SHEETS_MS)
+            return
+        self.telegram_bot = TelegramBot(tenant.telegram_bot_token, tenant.telegram_chat_id)
+        self.google_sheets = GoogleSheetsIntegration(tenant.google_credentials_file,
+                                                     tenant.google_sheet_id)
+
+    @property
+    def sheets_failed(self):
+        """Авторизация в Google не удалась - таблица недоступна до повторной попытки"""
+        return isinstance(self.google_sheets, GoogleSheetsIntegration) and self.google_sheets.worksheet is None
+
+    def reconnect_sheets(self):
+        """Повторная авторизация в Google; Telegram-бот не пересоздаётся"""
+        failed = self.google_sheets
+        self.google_sheets = GoogleSheetsIntegration(self.tenant.google_credentials_file,
+                                                     self.tenant.google_sheet_id)
+        failed.close()
+
+    def close(self):
+        self.telegram_bot.close()
+        self.google_sheets.close()
+
+class IntegrationPool:
+    """LRU-пул интеграций по клиентам.
+
+    Авторизация в Google выполняется один раз на клиента, а не на каждый
+    запрос. Давно не используемые клиенты вытесняются (по размеру пула и
+    по времени простоя), так что число клиентов не ограничено памятью.
+    """
+
+    def __init__(self, max_size, idle_seconds, retry_seconds):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.retry_seconds = retry_seconds
+        # tenant_id -> [интеграции, время последнего использования, время авторизации в Google]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant):
+        now = time.monotonic()
+        retry = False
+        with self._lock:
+            evicted = self._evict_idle(now)
+            entry = self._entries.get(tenant.id)
+            if entry is not None:
+                entry[1] = now
+                self._entries.move_to_end(tenant.id)
+                # Неудачную авторизацию в Google (например, временный сбой сети) не
+                # кэшируем навсегда: повторяем не чаще раза в retry_seconds, пока
+                # один поток авторизуется, остальные получают прежние интеграции
+                if entry[0].sheets_failed and now - entry[2] >= self.retry_seconds:
+                    entry[2] = now
+                    retry = True
+        self._close(evicted)
+        if entry is not None:
+            if retry:
+                entry[0].reconnect_sheets()
+            return entry[0]
+
+        # Авторизация - вне блокировки, чтобы не задерживать другие клиенты
+        integrations = TenantIntegrations(tenant)
+        with self._lock:
+            entry = self._entries.get(tenant.id)
+            if entry is None:
+                entry = self._entries[tenant.id] = [integrations, now, now]
+                integrations = None
+                while len(self._entries) > self.max_size:
+                    _, (evicted_integrations, _, _) = self._entries.popitem(last=False)
+                    evicted.append(evicted_integrations)
+            entry[1] = now
+            self._entries.move_to_end(tenant.id)
+        if integrations is not None:
+            evicted.append(integrations)  # другой поток успел создать раньше
+        self._close(evicted)
+        return entry[0]
+
+    def _evict_idle(self, now):
+        evicted = []
+        while self._entries:
+            tenant_id, (integrations, last_used, _) = next(iter(self._entries.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self._entries[tenant_id]
+            evicted.append(integrations)
+        return evicted
+
+    def _close(self, evicted):
+        for integrations in evicted:
+            try:
+                integrations.close()
+            except Exception as e:
+                logger.error(f"Failed to close tenant integrations: {e}")
+
+class TenantPrefixMiddleware:
+    """Выделение клиента из префикса URL: /t/<tenant>/room/1 -> /room/1"""
+
+    PREFIX = '/t/'
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.PREFIX):
+            tenant_id, _, rest = path[len(self.PREFIX):].partition('/')
+            environ['wc.tenant'] = tenant_id
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + self.PREFIX + tenant_id
+            environ['PATH_INFO'] = '/' + rest
+        return self.wsgi_app(environ, start_response)
+
+class EventBroker:
+    """Рассылка событий по заявкам подключённым диспетчерам.
+
+    События пишутся в общий журнал (SQLite), поэтому их видят все воркеры
+    gunicorn. Фоновый поток каждого воркера забирает новые события одним
+    запросом и кладёт в кольцевой буфер из последних EVENTS_HISTORY
+    событий; все подписчики читают из этого буфера, так что число
+    зрителей не увеличивает нагрузку на журнал.
+    """
+
+    def __init__(self, store, history_size, retention, poll_seconds):
+        self.store = store
+        self.history_size = history_size
+        self.retention = retention
+        self.poll_seconds = poll_seconds
+        self._events = deque(maxlen=history_size)  # (id, tenant, type, data)
+        self._last_id = 0
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.listeners = []  # вызываются с каждым новым событием в каждом воркере
+
+    def start(self):
+        self._fetch()
+        self._thread = threading.Thread(target=self._run, name='event-broker', daemon=True)
+        self._thread.start()
+
+    def publish(self, tenant_id, event_type, data):
+        """Публикация события (доставляется подписчикам всех воркеров)"""
+        if self.store.add_event(tenant_id, event_type, data, self.retention) is not None:
+            self._wakeup.set()
+
+    def _fetch(self):
+        try:
+            events = self.store.events_after(self._last_id, self.history_size)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to fetch events: {e}")
+            return
+        if events:
+            with self._condition:
+                self._events.extend(events)
+                self._last_id = events[-1][0]
+                self._condition.notify_all()
+        for event in events:
+            for listener in self.listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    logger.error(f"Event listener failed on event {event[0]}: {e}")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+            self._fetch()
+
+    def _pending(self, cursor):
+        """События из буфера после cursor (буфер упорядочен по номеру)"""
+        pending = []
+        for event in reversed(self._events):
+            if event[0] <= cursor:
+                break
+            pending.append(event)
+        pending.reverse()
+        return pending
+
+    def subscribe(self, tenant_id, last_event_id=None, keepalive=15):
+        """Поток событий клиента tenant_id.
+
+        Без last_event_id досылаются все события буфера, иначе - только
+        пропущенные после last_event_id. Если за keepalive секунд событий
+        не было, выдаётся None (для keepalive-комментария).
+        """
+        cursor = last_event_id or 0
+        while True:
+            with self._condition:
+                pending = self._pending(cursor)
+                if not pending:
+                    self._condition.wait(keepalive)
+                    pending = self._pending(cursor)
+            sent = False
+            for event in pending:
+                cursor = event[0]
+                if event[1] == tenant_id:
+                    sent = True
+                    yield event
+            if not sent:
+                yield None
+
+class NotificationJob:
+    """Задача очереди уведомлений, результат можно подождать"""
+
+    __slots__ = ('severity', 'func', 'args', 'enqueued_at', 'result', 'started', 'cancelled', '_done')
+
+    def __init__(self, severity, func, args):
+        self.severity = severity
+        self.func = func
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        self.result = None
+        self.started = False
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as e:
+            logger.error(f"Notification job failed: {e}")
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Ожидание выполнения, возвращает False по таймауту"""
+        return self._done.wait(timeout)
+
+class NotificationScheduler:
+    """Очередь исходящих уведомлений (Telegram и Google Sheets) с приоритетами.
+
+    Задача получает ключ «время постановки + допустимая задержка уровня
+    важности» и выполняется в порядке ключей. Срочные заявки обгоняют
+    накопившуюся очередь, а несрочные со временем выходят вперёд (старение)
+    и не голодают. Для каждого уровня собирается время ожидания в очереди.
+    Длина очереди ограничена max_queue: при недоступности Telegram или
+    Google Sheets новые заявки отклоняются (is_full), а не копятся в памяти.
+    """
+
+    def __init__(self, delays, workers, max_queue):
+        self.delays = delays
+        self.workers = workers
+        self.max_queue = max_queue
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {severity: {'queued': 0, 'started': 0, 'done': 0,
+                                  'wait_total': 0.0, 'wait_max': 0.0,
+                                  'recent': deque(maxlen=1000)}
+                       for severity in delays}
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f'notify-{i}', daemon=True).start()
+
+    def submit(self, severity, func, *args):
+        """Постановка задачи в очередь, возвращает NotificationJob"""
+        if severity not in self.delays:
+            severity = 'normal'
+        job = NotificationJob(severity, func, args)
+        key = job.enqueued_at + self.delays[severity]
+        with self._condition:
+            heapq.heappush(self._heap, (key, next(self._sequence), job))
+            self._stats[severity]['queued'] += 1
+            self._condition.notify()
+        return job
+
+    def is_full(self):
+        # Отменённые задачи остаются в куче до извлечения, поэтому считаем
+        # только ожидающие (счётчики queued уменьшает и cancel)
+        with self._condition:
+            return sum(stats['queued'] for stats in self._stats.values()) >= self.max_queue
+
+    def cancel(self, job):
+        """Отмена задачи, ещё не взятой в работу; False, если она уже выполняется"""
+        with self._condition:
+            if job.started or job.cancelled:
+                return job.cancelled
+            job.cancelled = True
+            self._stats[job.severity]['queued'] -= 1
+            return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                _, _, job = heapq.heappop(self._heap)
+                if job.cancelled:
+                    continue
+                stats = self._stats[job.severity]
+                stats['queued'] -= 1
+                job.started = True
+                stats['started'] += 1
+                waited = time.monotonic() - job.enqueued_at
+                stats['wait_total'] += waited
+                stats['wait_max'] = max(stats['wait_max'], waited)
+                stats['recent'].append(waited)
+            job.run()
+            with self._condition:
+                stats['done'] += 1
+
+    def stats(self):
+        """Длина очереди и время ожидания (в секундах) по уровням важности"""
+        with self._condition:
+            result = {}
+            for severity, stats in self._stats.items():
+                recent = sorted(stats['recent'])
+                result[severity] = {
+                    'queued': stats['queued'],
+                    'started': stats['started'],
+                    'done': stats['done'],
+                    'wait_avg': stats['wait_total'] / max(stats['started'], 1),
+                    'wait_p95': recent[int(len(recent) * 0.95)] if recent else 0.0,
+                    'wait_max': stats['wait_max']
+                }
+            return result
+
+class _Waiter:
+    """Запрос, ожидающий слота в AdmissionController"""
+
+    __slots__ = ('key', 'endpoint', 'event', 'granted')
+
+    def __init__(self, key, endpoint):
+        self.key = key  # (приоритет, порядковый номер)
+        self.endpoint = endpoint
+        self.event = threading.Event()
+        self.granted = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+class AdmissionController:
+    """Контроль допуска запросов и сброс нагрузки.
+
+    Общая ёмкость воркера делится между эндпоинтами, у каждого свой лимит
+    одновременных запросов и своя ограниченная очередь. Освободившийся слот
+    получает ожидающий запрос с наивысшим приоритетом (меньшее число).
+    Запросы сверх очереди и не дождавшиеся слота за queue_timeout секунд
+    сразу отклоняются, а не ждут таймаута nginx. Эндпоинты с shared=False
+    (долгие соединения) ограничены только своим лимитом и не занимают
+    общую ёмкость.
+    """
+
+    def __init__(self, capacity, queue_timeout, retry_after):
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._endpoints = {}
+        self._waiters = []  # отсортированы по (приоритет, порядковый номер)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add_endpoint(self, name, priority, max_in_flight, max_queue, shared=True):
+        self._endpoints[name] = {
+            'priority': priority,
+            'shared': shared,
+            'max_in_flight': max_in_flight,
+            'max_queue': max_queue,
+            'in_flight': 0,
+            'queued': 0,
+            'admitted': 0,
+            'shed': 0
+        }
+
+    def _can_run(self, endpoint):
+        if endpoint['in_flight'] >= endpoint['max_in_flight']:
+            return False
+        return not endpoint['shared'] or self._in_flight < self.capacity
+
+    def _grant(self, endpoint):
+        if endpoint['shared']:
+            self._in_flight += 1
+        endpoint['in_flight'] += 1
+        endpoint['admitted'] += 1
+
+    def acquire(self, name):
+        """Получение слота, возвращает False если запрос нужно отклонить"""
+        endpoint = self._endpoints[name]
+        with self._lock:
+            if self._can_run(endpoint) and endpoint['queued'] == 0:
+                self._grant(endpoint)
+                return True
+            if endpoint['queued'] >= endpoint['max_queue']:
+                endpoint['shed'] += 1
+                return False
+            waiter = _Waiter((endpoint['priority'], next(self._sequence)), endpoint)
+            bisect.insort(self._waiters, waiter)
+            endpoint['queued'] += 1
+
+        if waiter.event.wait(self.queue_timeout):
+            return True
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            endpoint['queued'] -= 1
+            endpoint['shed'] += 1
+            return False
+
+    def release(self, name):
+        endpoint = self._endpoints[name]
+        with self._lock:
+            if endpoint['shared']:
+                self._in_flight -= 1
+            endpoint['in_flight'] -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """Передача свободных слотов ожидающим запросам по приоритету"""
+        remaining = []
+        for waiter in self._waiters:
+            if self._can_run(waiter.endpoint):
+                waiter.endpoint['queued'] -= 1
+                self._grant(waiter.endpoint)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                remaining.append(waiter)
+        self._waiters = remaining
+
+    def limit(self, name):
+        """Декоратор для view-функции эндпоинта name"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.acquire(name):
+                    return self.shed_response(name)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(name)
+            return wrapper
+        return decorator
+
+    def shed_response(self, name):
+        logger.warning(f"Request to {name} shed by admission control")
+        return (jsonify({'error': 'Service overloaded, retry later'}), 503,
+                {'Retry-After': str(self.retry_after)})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'in_flight': self._in_flight,
+                'queued': len(self._waiters),
+                'endpoints': {name: dict(endpoint) for name, endpoint in self._endpoints.items()}
+            }
+
+admission = AdmissionController(config.ADMISSION_CAPACITY, config.ADMISSION_QUEUE_TIMEOUT,
+                                config.ADMISSION_RETRY_AFTER)
+# Заявки важнее генерации QR-кодов для администратора
+admission.add_endpoint('submit', 0, config.SUBMIT_MAX_IN_FLIGHT, config.SUBMIT_MAX_QUEUE)
+admission.add_endpoint('qr', 1, config.QR_MAX_IN_FLIGHT, config.QR_MAX_QUEUE)
+# Подписка на события держит поток воркера всё время соединения: отдельный
+# лимит без очереди, чтобы зрители панели не заняли потоки для заявок
+admission.add_endpoint('events', 2, config.EVENTS_MAX_SUBSCRIBERS, 0, shared=False)
+
+class TrafficRecorder:
+    """Запись времени и формы запросов для воспроизведения (replay_traffic.py).
+
+    Одна короткая JSON-строка на запрос: время прихода, длительность, код
+    ответа и форма данных. Текст описания и фото не сохраняются (только
+    размеры), номер помещения заменяется хэшем с солью. Строки дописываются
+    одним write() в файл, открытый с O_APPEND, поэтому воркеры gunicorn
+    могут писать в один файл.
+    
+    Длительность обработки отдаётся и без записи, в заголовке Server-Timing:
+    при воспроизведении время на стенде сравнивается с записанным.
+    """
+
+    def __init__(self, path, salt):
+        self.path = path
+        self.salt = salt.encode('utf-8') or os.urandom(16)
+        self._fd = None
+        if path:
+            if not salt:
+                logger.warning("CAPTURE_SALT is not set, room tokens will differ between workers")
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            logger.info(f"Traffic capture enabled: {path}")
+
+    def room_token(self, number):
+        return hashlib.blake2b(str(number).encode('utf-8'), key=self.salt[:64],
+                               digest_size=4).hexdigest()
+
+    def _shape(self, name, kwargs):
+        """Форма запроса без содержимого"""
+        if name == 'qr':
+            return {'r': self.room_token(kwargs.get('room_number'))}
+        if request.mimetype == 'multipart/form-data':
+            data = request.form
+            try:
+                room = json.loads(data.get('room') or '{}')
+            except ValueError:
+                room = {}
+            photo = request.files.get('photo')
+            has_photo = bool(photo and photo.filename)
+        else:
+            data = request.get_json(silent=True) or {}
+            room = data.get('room') or {}
+            has_photo = False
+        problem = data.get('problem_type')
+        return {
+            'r': self.room_token(room.get('number') if isinstance(room, dict) else None),
+            'p': problem if problem in config.PROBLEM_TYPES else 'custom',
+            'dl': len(data.get('description') or ''),
+            'ph': int(has_photo),
+            'b': request.content_length or 0
+        }
+
+    def capture(self, name):
+        """Декоратор view-функции: время обработки в Server-Timing и запись запроса"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                arrived = time.time()
+                started = time.perf_counter()
+                response = app.make_response(view(*args, **kwargs))
+                duration = round((time.perf_counter() - started) * 1000, 1)
+                response.headers['Server-Timing'] = f'app;dur={duration}'
+                if self._fd is None:
+                    return response
+                
+                record = {'t': round(arrived, 3), 'e': name, 's': response.status_code, 'ms': duration}
+                try:
+                    record.update(self._shape(name, kwargs))
+                    if (response.get_json(silent=True) or {}).get('queued'):
+                        record['q'] = 1
+                    os.write(self._fd, (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+                except Exception as e:
+                    logger.error(f"Failed to capture {name} request: {e}")
+                return response
+            return wrapper
+        return decorator
+
+traffic_recorder = TrafficRecorder(config.CAPTURE_FILE, config.CAPTURE_SALT)
+
+def demo_rooms():
+    """Тестовый список помещений (если файл со списком не задан)"""
+    rooms = []
+    for i in range(1, 101):  # 100 помещений
+        rooms.append({
+            'number': i,
+            'building': 'A' if i <= 50 else 'B',
+            'floor': str((i - 1) // 10 + 1).zfill(2),
+            'type': 'WC' if i % 3 == 0 else 'OFFICE',
+            'name': config.ROOM_TYPES.get('WC' if i % 3 == 0 else 'OFFICE')
+        })
+    return rooms
+
+def load_rooms(rooms_file):
+    """Чтение списка помещений из CSV (number,building,floor,type,name)"""
+    if not rooms_file or not os.path.exists(rooms_file):
+        return demo_rooms()
+    with open(rooms_file, encoding='utf-8', newline='') as f:
+        return [{field: row.get(field) or '' for field in RoomIndex.FIELDS}
+                for row in csv.DictReader(f)]
+
+class RoomIndex:
+    """Компактный префиксный индекс помещений для автодополнения.
+
+    Записи хранятся по столбцам: номера - одной строкой со смещениями в
+    array('I'), корпус, этаж, тип и название - кодами в array('I') из общего
+    словаря значений. Для поиска по префиксу номера записи отсортированы по
+    номеру (array('I')), а слова корпуса и названия лежат в отсортированном
+    списке с массивами номеров записей. Изменения списка применяются
+    точечно: удалённые записи помечаются в bytearray, новые дописываются в
+    конец; когда удалённых больше четверти, индекс пересобирается.
+    
+    Индекс не изменяется во время поиска: update() вызывается на копии
+    (copy()), которая затем подменяет исходный индекс целиком.
+    """
+
+    FIELDS = ('number', 'building', 'floor', 'type', 'name')
+    CODED_FIELDS = ('building', 'floor', 'type', 'name')
+
+    def __init__(self, rooms=()):
+        self.load(rooms)
+
+    @staticmethod
+    def room_key(room):
+        return (str(room['building']), str(room['number']))
+
+    def load(self, rooms):
+        """Полная сборка индекса"""
+        self._numbers = ''
+        self._offsets = array('I', [0])
+        self._int_numbers = bytearray()  # номер был числом (тестовый список)
+        self._values = []
+        self._value_words = []  # слова значения в нижнем регистре
+        self._codes = {}
+        self._columns = {field: array('I') for field in self.CODED_FIELDS}
+        self._deleted = bytearray()
+        self._deleted_count = 0
+        self._by_number = array('I')
+        self._words = []
+        self._postings = []
+        self._append(list(rooms))
+
+    def copy(self):
+        """Копия индекса для update(); исходный индекс остаётся доступен для поиска"""
+        index = RoomIndex.__new__(RoomIndex)
+        index.__dict__.update(self.__dict__)
+        for name in ('_offsets', '_int_numbers', '_values', '_value_words', '_deleted',
+                     '_by_number', '_words', '_postings'):
+            setattr(index, name, getattr(self, name)[:])
+        index._codes = dict(self._codes)
+        index._columns = {field: column[:] for field, column in self._columns.items()}
+        return index
+
+    def _code(self, value):
+        value = str(value or '')
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+            self._value_words.append(tuple(value.lower().split()))
+        return code
+
+    def _append(self, rooms):
+        first_id = len(self._deleted)
+        numbers = []
+        new_words = {}
+        for record_id, room in enumerate(rooms, first_id):
+            number = room['number']
+            self._int_numbers.append(isinstance(number, int))
+            number = str(number)
+            numbers.append(number)
+            self._offsets.append(self._offsets[-1] + len(number))
+            for field in self.CODED_FIELDS:
+                self._columns[field].append(self._code(room.get(field)))
+            self._deleted.append(0)
+            for word in set(self._words_of(record_id)):
+                record_ids = new_words.get(word)
+                if record_ids is None:
+                    record_ids = new_words[word] = array('I')
+                record_ids.append(record_id)
+        self._numbers += ''.join(numbers)
+
+        new_ids = sorted(range(first_id, first_id + len(rooms)), key=self._number_key)
+        if first_id == 0:
+            self._by_number = array('I', new_ids)
+            self._words = sorted(new_words)
+            self._postings = [new_words[word] for word in self._words]
+            return
+
+        for record_id in new_ids:
+            self._by_number.insert(self._lower_bound(self._number_key(record_id)), record_id)
+        for word, record_ids in new_words.items():
+            position = bisect.bisect_left(self._words, word)
+            if position < len(self._words) and self._words[position] == word:
+                # Новый массив, а не extend: старый может читать исходный индекс
+                self._postings[position] = self._postings[position] + record_ids
+            else:
+                self._words.insert(position, word)
+                self._postings.insert(position, record_ids)
+
+    def _words_of(self, record_id):
+        """Слова корпуса и названия записи"""
+        return (self._value_words[self._columns['building'][record_id]]
+                + self._value_words[self._columns['name'][record_id]])
+
+    def _number(self, record_id):
+        return self._numbers[self._offsets[record_id]:self._offsets[record_id + 1]]
+
+    def _number_key(self, record_id):
+        return self._number(record_id).lower()
+
+    def _lower_bound(self, value):
+        """Первая позиция в _by_number с номером не меньше value"""
+        low, high = 0, len(self._by_number)
+        while low < high:
+            middle = (low + high) // 2
+            if self._number_key(self._by_number[middle]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _same(self, record_id, room):
+        """Совпадает ли запись с помещением из нового списка"""
+        if isinstance(room['number'], int) != bool(self._int_numbers[record_id]):
+            return False
+        for field in self.CODED_FIELDS:
+            if self._codes.get(str(room.get(field) or '')) != self._columns[field][record_id]:
+                return False
+        return True
+
+    def record(self, record_id):
+        number = self._number(record_id)
+        room = {'number': int(number) if self._int_numbers[record_id] else number}
+        for field in self.CODED_FIELDS:
+            room[field] = self._values[self._columns[field][record_id]]
+        return room
+
+    def __len__(self):
+        return len(self._deleted) - self._deleted_count
+
+    def rooms(self):
+        return [self.record(record_id) for record_id in range(len(self._deleted))
+                if not self._deleted[record_id]]
+
+    def update(self, rooms):
+        """Точечное применение нового списка помещений"""
+        current = {self.room_key(room): room for room in rooms}
+        live = set()
+        building_codes = self._columns['building']
+        for record_id in range(len(self._deleted)):
+            if self._deleted[record_id]:
+                continue
+            key = (self._values[building_codes[record_id]], self._number(record_id))
+            room = current.get(key)
+            if room is None or key in live or not self._same(record_id, room):
+                self._deleted[record_id] = 1
+                self._deleted_count += 1
+            else:
+                live.add(key)
+        self._append([room for key, room in current.items() if key not in live])
+        if self._deleted_count * 4 > len(self._deleted):
+            self.load(self.rooms())
+
+    def _candidates(self, term):
+        """Число и перечень записей, у которых номер или слово начинается с term"""
+        upper = term + '\U0010ffff'
+        start, end = self._lower_bound(term), self._lower_bound(upper)
+        word_start = bisect.bisect_left(self._words, term)
+        word_end = bisect.bisect_left(self._words, upper)
+        count = end - start + sum(len(self._postings[i]) for i in range(word_start, word_end))
+
+        def records():
+            for position in range(start, end):
+                yield self._by_number[position]
+            for i in range(word_start, word_end):
+                yield from self._postings[i]
+        return count, records()
+
+    def _matches(self, record_id, term):
+        return (self._number_key(record_id).startswith(term)
+                or any(word.startswith(term) for word in self._words_of(record_id)))
+
+    def search(self, query, limit=10):
+        """Помещения, у которых каждое слово запроса - префикс номера или слова"""
+        terms = query.lower().split()
+        if not terms:
+            return []
+        # Перебираем записи самого редкого слова запроса, остальные проверяем
+        candidates = [self._candidates(term) for term in terms]
+        rarest = min(range(len(terms)), key=lambda i: candidates[i][0])
+        others = terms[:rarest] + terms[rarest + 1:]
+
+        results, seen = [], set()
+        for record_id in candidates[rarest][1]:
+            if record_id in seen or self._deleted[record_id]:
+                continue
+            seen.add(record_id)
+            if all(self._matches(record_id, term) for term in others):
+                results.append(self.record(record_id))
+                if len(results) >= limit:
+                    break
+        return results
+
+class RoomCatalog:
+    """Список помещений с индексом поиска, обновляется при изменении файла"""
+
+    def __init__(self, rooms_file, check_seconds):
+        self.rooms_file = rooms_file
+        self.check_seconds = check_seconds
+        self._mtime = self._file_mtime()
+        self._checked = time.monotonic()
+        self._lock = threading.Lock()
+        self.index = RoomIndex(load_rooms(rooms_file))
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.rooms_file)
+        except OSError:
+            return None
+
+    def refresh(self):
+        """Проверка файла (не чаще check_seconds) и обновление индекса"""
+        now = time.monotonic()
+        if now - self._checked < self.check_seconds:
+            return
+        with self._lock:
+            if now - self._checked < self.check_seconds:
+                return
+            self._checked = now
+            mtime = self._file_mtime()
+            if mtime == self._mtime:
+                return
+            try:
+                # Изменяем копию и подменяем индекс целиком: поиск в других
+                # потоках видит либо старый, либо новый индекс
+                index = self.index.copy()
+                index.update(load_rooms(self.rooms_file))
+                self.index = index
+                self._mtime = mtime
+                logger.info(f"Room index updated from {self.rooms_file}: {len(self.index)} rooms")
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Failed to update room index from {self.rooms_file}: {e}")
+
+    def rooms(self):
+        self.refresh()
+        return self.index.rooms()
+
+    def search(self, query, limit):
+        self.refresh()
+        return self.index.search(query, limit)
+
+room_catalogs = {}
+room_catalogs_lock = threading.Lock()
+
+def room_catalog(tenant):
+    """Список помещений клиента (один индекс на файл в воркере)"""
+    with room_catalogs_lock:
+        catalog = room_catalogs.get(tenant.rooms_file)
+        if catalog is None:
+            catalog = room_catalogs[tenant.rooms_file] = RoomCatalog(tenant.rooms_file,
+                                                                     config.ROOMS_CHECK_SECONDS)
+    return catalog
 
 # Инициализация интеграций
-telegram_bot = TelegramBot(config.TELEGRAM_BOT_TOKEN, config.TELEGRAM_CHAT_ID)
-google_sheets = GoogleSheetsIntegration(config.GOOGLE_CREDENTIALS_FILE, config.GOOGLE_SHEET_ID)
+tenant_registry = TenantRegistry(config.TENANTS_FILE)
+integration_pool = IntegrationPool(config.TENANT_POOL_SIZE, config.TENANT_IDLE_SECONDS,
+                                   config.SHEETS_RETRY_SECONDS)
+app.wsgi_app = TenantPrefixMiddleware(app.wsgi_app)
+
+def telegram_bot_for(tenant_id):
+    tenant = tenant_registry.get(tenant_id)
+    if tenant is None:
+        logger.warning(f"Unknown tenant: {tenant_id}")
+        return None
+    return integration_pool.get(tenant).telegram_bot
+
+ticket_store = TicketStore(config.DATABASE_URL)
+ticket_archive = TicketArchive(config.ARCHIVE_FOLDER)
+sla_scheduler = SLAScheduler(ticket_store, telegram_bot_for, config.SLA_MINUTES,
+                             config.TICKET_STATUSES[0], config.SLA_RETRY_MINUTES)
+event_broker = EventBroker(ticket_store, config.EVENTS_HISTORY, config.EVENTS_RETENTION,
+                           config.EVENTS_POLL_SECONDS)
+# Процессы обработки фото при запуске через `python app.py` заново импортируют
+# этот файл - фоновые задачи запускаются только в процессах веб-сервера
+background = multiprocessing.parent_process() is None
+if background:
+    event_broker.start()
+sla_scheduler.on_escalated = lambda ticket: event_broker.publish(
+    ticket['tenant'], 'ticket_escalated', {'id': ticket['id']})
+
+def schedule_reopened(event):
+    """Новый срок реакции для заявки, возвращённой в «Новая» (в любом воркере или в reconcile.py)"""
+    _, _, event_type, data = event
+    data = json.loads(data)
+    if event_type == 'status_changed' and 'reopened_at' in data:
+        sla_scheduler.schedule(data['id'], sla_scheduler.deadline_for(
+            data['problem_key'], datetime.fromisoformat(data['reopened_at'])))
+
+event_broker.listeners.append(schedule_reopened)
+
+def ticket_status_changed(tenant_id, ticket, status):
+    """Контроль сроков и событие для панели после смены статуса (ticket - заявка до изменения)"""
+    event = {'id': ticket['id'], 'status': status}
+    if status != config.TICKET_STATUSES[0]:
+        # Заявка взята в работу - контроль срока реакции больше не нужен
+        sla_scheduler.discard(ticket['id'])
+    elif ticket['status'] != status:
+        # Заявку вернули в новые - срок реакции отсчитывается заново;
+        # дедлайн ставят все воркеры, получив событие (schedule_reopened)
+        ticket_store.release_escalation(ticket['id'])
+        event.update(reopened_at=datetime.now().isoformat(), problem_key=ticket['problem_key'])
+    event_broker.publish(tenant_id, 'status_changed', event)
+if config.SLA_ENABLED and background:
+    sla_scheduler.start()
+notification_scheduler = NotificationScheduler(config.SEVERITY_DELAYS, config.NOTIFY_WORKERS,
+                                               config.NOTIFY_MAX_QUEUE)
+if background:
+    notification_scheduler.start()
+photo_processor = PhotoProcessor(config.UPLOAD_FOLDER, config.PHOTO_MAX_SIZE,
+                                 config.PHOTO_QUALITY, config.PHOTO_WORKERS)
+
+@app.before_request
+def resolve_tenant():
+    """Определение клиента для текущего запроса"""
+    g.tenant = tenant_registry.resolve(request.host, request.environ.get('wc.tenant'))
+    if g.tenant is None:
+        return jsonify({'error': 'Unknown tenant'}), 404
+
+def tenant_base_url():
+    """Базовый URL текущего клиента (для ссылок в QR-кодах и таблице)"""
+    return g.tenant.base_url or (config.BASE_URL.rstrip('/') + request.script_root)
+
+def format_ticket_message(request_data, title='🚨 <b>Новая заявка на обслуживание</b>'):
+    """Сообщение о заявке для Telegram"""
+    room = request_data['room']
+    return f"""
+{title}
+
+📍 <b>Помещение:</b> Корпус {room['building']}, {room['floor']} этаж, {room['type']} №{room['number']}
+🔧 <b>Проблема:</b> {request_data['problem_type']}
+📝 <b>Описание:</b> {request_data['description'] or 'Не указано'}
+📅 <b>Дата:</b> {request_data['date']}
+🕐 <b>Время:</b> {request_data['time']}
+
+#заявка #помещение{room['number']}
+    """.strip()
 
 @app.route('/')
 def index():
@@ -178,11 +2066,54 @@ def room_form(room_number):
                          room=room_data,
                          problem_types=config.PROBLEM_TYPES)
 
+def deliver_ticket(integrations, ticket_id, telegram_message, request_data):
+    """Отправка заявки в Telegram и Google Sheets (выполняется в очереди уведомлений)"""
+    try:
+        telegram_success = integrations.telegram_bot.send_message(telegram_message)
+        sheets_success = integrations.google_sheets.add_request(request_data)
+        ticket_store.mark_delivery(ticket_id, telegram_success, sheets_success)
+    except Exception:
+        if request_data.get('photo'):
+            photo_processor.discard(request_data['photo'])
+        raise
+    if request_data.get('photo'):
+        room = request_data['room']
+        caption = f"📷 Фото к заявке №{ticket_id}: {room['type']} №{room['number']}, корпус {room['building']}"
+        photo_processor.submit(request_data['photo'], caption, integrations.telegram_bot)
+    return telegram_success, sheets_success
+
 @app.route('/api/submit_request', methods=['POST'])
+@traffic_recorder.capture('submit')
+@admission.limit('submit')
 def submit_request():
     """API для отправки заявки"""
+    # Очередь уведомлений переполнена (Telegram или Google Sheets недоступны):
+    # новые заявки отклоняем, пока она не разберётся. Проверка до постановки
+    # в очередь, поэтому очередь может превысить лимит не больше чем на
+    # SUBMIT_MAX_IN_FLIGHT задач
+    if notification_scheduler.is_full():
+        return admission.shed_response('submit')
+    
+    # Сохранённое фото, пока его не забрала задача отправки: на всех путях
+    # с ошибкой или отменой файл удаляется, чтобы не копился в uploads/raw
+    photo_name = None
     try:
-        data = request.get_json()
+        # Заявка с фото приходит как multipart/form-data, без фото - как JSON
+        photo = None
+        if request.mimetype == 'multipart/form-data':
+            data = request.form.to_dict()
+            try:
+                if 'room' in data:
+                    data['room'] = json.loads(data['room'])
+            except ValueError:
+                return jsonify({'error': 'Invalid field: room'}), 400
+            photo = request.files.get('photo')
+            if photo and not photo.filename:
+                photo = None
+            if photo and not (photo.mimetype or '').startswith('image/'):
+                return jsonify({'error': 'Photo must be an image'}), 400
+        else:
+            data = request.get_json()
         
         # Валидация данных
         required_fields = ['room', 'problem_type']
@@ -191,6 +2122,7 @@ def submit_request():
                 return jsonify({'error': f'Missing field: {field}'}), 400
         
         # Подготовка данных заявки
+        problem_key = data['problem_type']
         now = datetime.now()
         request_data = {
             'room': data['room'],
@@ -203,26 +2135,65 @@ def submit_request():
         
         # Формирование сообщения для Telegram
         room = request_data['room']
-        telegram_message = f"""
-🚨 <b>Новая заявка на обслуживание</b>
-
-📍 <b>Помещение:</b> Корпус {room['building']}, {room['floor']} этаж, {room['type']} №{room['number']}
-🔧 <b>Проблема:</b> {request_data['problem_type']}
-📝 <b>Описание:</b> {request_data['description'] or 'Не указано'}
-📅 <b>Дата:</b> {request_data['date']}
-🕐 <b>Время:</b> {request_data['time']}
-
-#заявка #помещение{room['number']}
-        """.strip()
+        telegram_message = format_ticket_message(request_data)
+        
+        # Файл сохраняется на диск потоково, обработка - после ответа
+        if photo:
+            photo_name = request_data['photo'] = photo_processor.save_upload(photo)
+            request_data['photo_url'] = photo_processor.url(photo_name, tenant_base_url())
         
-        # Отправка в Telegram и Google Sheets
-        telegram_success = telegram_bot.send_message(telegram_message)
-        sheets_success = google_sheets.add_request(request_data)
+        # Сохранение в локальный журнал
+        ticket_id = ticket_store.add_ticket(request_data, problem_key, g.tenant.id)
+        
+        # Отправка в Telegram и Google Sheets через очередь с приоритетом по важности проблемы
+        severity = config.PROBLEM_SEVERITY.get(problem_key, 'normal')
+        job = notification_scheduler.submit(severity, deliver_ticket, integration_pool.get(g.tenant),
+                                            ticket_id, telegram_message, request_data)
+        queued_photo, photo_name = photo_name, None
+        if ticket_id is not None:
+            sla_scheduler.schedule(ticket_id, sla_scheduler.deadline_for(problem_key, now))
+            event_broker.publish(g.tenant.id, 'ticket_created', {
+                'id': ticket_id,
+                'date': request_data['date'],
+                'time': request_data['time'],
+                'building': room.get('building'),
+                'floor': room.get('floor'),
+                'room_type': room.get('type'),
+                'room_number': room.get('number'),
+                'problem_type': request_data['problem_type'],
+                'description': request_data['description'],
+                'status': config.TICKET_STATUSES[0],
+                'photo_url': request_data.get('photo_url')
+            })
+        
+        finished = job.wait(config.NOTIFY_WAIT_SECONDS)
+        if not finished and ticket_id is None:
+            # Заявка не сохранена в журнале - обещать отправку нельзя: отменяем
+            # задачу, а если она уже выполняется - дожидаемся результата
+            if notification_scheduler.cancel(job):
+                if queued_photo:
+                    photo_processor.discard(queued_photo)
+                return jsonify({
+                    'success': False,
+                    'message': 'Ошибка при сохранении заявки, попробуйте ещё раз'
+                }), 500
+            finished = job.wait()
+        
+        # При очереди не держим пользователя: заявка уже в журнале и будет отправлена
+        if not finished:
+            return jsonify({
+                'success': True,
+                'message': 'Заявка принята и будет отправлена в ближайшее время',
+                'ticket_id': ticket_id,
+                'queued': True
+            })
         
+        telegram_success, sheets_success = job.result or (False, False)
         if telegram_success or sheets_success:
             return jsonify({
                 'success': True,
                 'message': 'Заявка отправлена успешно!',
+                'ticket_id': ticket_id,
                 'telegram_sent': telegram_success,
                 'sheets_saved': sheets_success
             })
@@ -232,15 +2203,42 @@ def submit_request():
                 'message': 'Ошибка при отправке заявки'
             }), 500
         
+    except RequestEntityTooLarge:
+        # Размер проверяется при чтении формы (MAX_CONTENT_LENGTH)
+        return jsonify({
+            'error': f'Request too large (max {config.MAX_UPLOAD_MB} MB)',
+            'message': f'Фото слишком большое (не больше {config.MAX_UPLOAD_MB} МБ)'
+        }), 413
     except Exception as e:
         logger.error(f"Error submitting request: {e}")
         return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        if photo_name:
+            photo_processor.discard(photo_name)
+
+@app.route('/api/tickets/<int:ticket_id>/status', methods=['POST'])
+def update_ticket_status(ticket_id):
+    """API для изменения статуса заявки"""
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in config.TICKET_STATUSES:
+        return jsonify({'error': f'Invalid status: {status}'}), 400
+    
+    ticket = ticket_store.update_status(ticket_id, status, g.tenant.id)
+    if ticket is None:
+        return jsonify({'error': 'Ticket not found'}), 404
+    
+    ticket_status_changed(g.tenant.id, ticket, status)
+    
+    return jsonify({'success': True, 'ticket_id': ticket_id, 'status': status})
 
 @app.route('/api/generate_qr/<int:room_number>')
+@traffic_recorder.capture('qr')
+@admission.limit('qr')
 def generate_qr(room_number):
     """Генерация QR-кода для помещения"""
     try:
-        url = f"{config.BASE_URL}/room/{room_number}"
+        url = f"{tenant_base_url()}/room/{room_number}"
         
         # Создание QR-кода
         qr = qrcode.QRCode(
@@ -271,6 +2269,51 @@ def generate_qr(room_number):
         logger.error(f"Error generating QR code: {e}")
         return jsonify({'error': 'Failed to generate QR code'}), 500
 
+@app.route('/photos/<name>')
+def get_photo(name):
+    """Обработанное фото к заявке"""
+    return send_from_directory(photo_processor.upload_folder, name)
+
+@app.route('/api/events')
+def ticket_events():
+    """Поток событий по заявкам (Server-Sent Events)"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('last_event_id', type=int)
+    tenant_id = g.tenant.id
+    if not admission.acquire('events'):
+        return admission.shed_response('events')
+    
+    def stream():
+        yield 'retry: 3000\n\n'
+        for event in event_broker.subscribe(tenant_id, last_event_id, config.SSE_KEEPALIVE_SECONDS):
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            event_id, _, event_type, data = event
+            yield f'id: {event_id}\nevent: {event_type}\ndata: {data}\n\n'
+    
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Слот освобождается, когда сервер закрывает поток (клиент отключился)
+    response.call_on_close(lambda: admission.release('events'))
+    return response
+
+@app.route('/api/notifications')
+def notification_stats():
+    """Очередь уведомлений: длина и время ожидания по уровням важности"""
+    return jsonify(notification_scheduler.stats())
+
+@app.route('/api/admission')
+def admission_stats():
+    """Состояние контроля допуска: очереди и число отклонённых запросов"""
+    return jsonify(admission.stats())
+
+@app.route('/admin/dashboard')
+def admin_dashboard():
+    """Панель диспетчера с заявками в реальном времени"""
+    return render_template('admin_dashboard.html', statuses=config.TICKET_STATUSES)
+
 @app.route('/admin/qr_codes')
 def admin_qr_codes():
     """Административная страница для генерации QR-кодов"""
@@ -279,19 +2322,173 @@ def admin_qr_codes():
 @app.route('/api/rooms')
 def get_rooms():
     """API для получения списка помещений"""
-    # Здесь можно добавить логику получения из БД
-    # Пока возвращаем тестовые данные
-    rooms = []
-    for i in range(1, 101):  # 100 помещений
-        rooms.append({
-            'number': i,
-            'building': 'A' if i <= 50 else 'B',
-            'floor': str((i - 1) // 10 + 1).zfill(2),
-            'type': 'WC' if i % 3 == 0 else 'OFFICE',
-            'name': config.ROOM_TYPES.get('WC' if i % 3 == 0 else 'OFFICE')
-        })
-    
-    return jsonify(rooms)
+    # Список из ROOMS_FILE, если файла нет - тестовые данные
+    return jsonify(room_catalog(g.tenant).rooms())
+
+@app.route('/api/rooms/search')
+def search_rooms():
+    """Поиск помещений по номеру, названию и корпусу (автодополнение)"""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify(room_catalog(g.tenant).search(query, limit))
+
+# Колонки выгрузки: поле журнала -> заголовок
+EXPORT_COLUMNS = [
+    ('id', '№'),
+    ('date', 'Дата'),
+    ('time', 'Время'),
+    ('building', 'Корпус'),
+    ('floor', 'Этаж'),
+    ('room_type', 'Тип помещения'),
+    ('room_number', 'Номер'),
+    ('problem_type', 'Проблема'),
+    ('description', 'Описание'),
+    ('status', 'Статус')
+]
+
+class _StreamBuffer:
+    """Буфер, из которого генератор забирает уже записанные байты"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _export_csv(chunks):
+    """Потоковая выгрузка в CSV"""
+    yield '\ufeff'.encode('utf-8')  # BOM для корректного открытия в Excel
+    yield _csv_line([title for _, title in EXPORT_COLUMNS])
+    for rows in chunks:
+        yield b''.join(_csv_line([row[field] for field, _ in EXPORT_COLUMNS]) for row in rows)
+
+def _csv_line(values):
+    line = StringIO()
+    csv.writer(line).writerow(values)
+    return line.getvalue().encode('utf-8')
+
+def _xlsx_cell(column, row_number, value):
+    ref = f"{chr(ord('A') + column)}{row_number}"
+    if isinstance(value, int):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = xml_escape(''.join(ch for ch in str(value or '') if ch in '\t\n\r' or ch >= ' '))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _xlsx_row(row_number, values):
+    cells = ''.join(_xlsx_cell(i, row_number, value) for i, value in enumerate(values))
+    return f'<row r="{row_number}">{cells}</row>'.encode('utf-8')
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Заявки" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>')
+}
+
+def _export_xlsx(chunks):
+    """Потоковая выгрузка в XLSX (zip пишется в буфер без перемотки)"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        b'<sheetData>')
+            sheet.write(_xlsx_row(1, [title for _, title in EXPORT_COLUMNS]))
+            row_number = 1
+            for rows in chunks:
+                for row in rows:
+                    row_number += 1
+                    sheet.write(_xlsx_row(row_number, [row[field] for field, _ in EXPORT_COLUMNS]))
+                yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+EXPORT_FORMATS = {
+    'csv': (_export_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (_export_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+@app.route('/api/export')
+def export_tickets():
+    """Выгрузка заявок в CSV/XLSX с фильтрами"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {export_format}'}), 400
+
+    try:
+        date_from = _parse_date(request.args.get('date_from'))
+        date_to = _parse_date(request.args.get('date_to'))
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    if date_to:
+        date_to += timedelta(days=1)  # включительно
+
+    # Проблему можно указать ключом или текстом из PROBLEM_TYPES
+    problem = request.args.get('problem')
+    problem_keys = {label: key for key, label in config.PROBLEM_TYPES.items()}
+    problem = problem_keys.get(problem, problem)
+
+    filters = {
+        'building': request.args.get('building'),
+        'room_type': request.args.get('room_type'),
+        'room': request.args.get('room'),
+        'problem': problem,
+        'status': request.args.get('status')
+    }
+    # Сначала старые заявки из архива (только нужные месяцы), затем журнал
+    chunks = itertools.chain(
+        ticket_archive.iter_tickets(g.tenant.id, date_from=date_from, date_to=date_to,
+                                    chunk_size=config.EXPORT_CHUNK_SIZE, **filters),
+        ticket_store.iter_tickets(date_from=date_from, date_to=date_to,
+                                  chunk_size=config.EXPORT_CHUNK_SIZE, tenant=g.tenant.id, **filters))
+
+    writer, mimetype = EXPORT_FORMATS[export_format]
+    filename = f"tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(stream_with_context(writer(chunks)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Перенос старых выполненных заявок из журнала в сжатый архив
+Архив разбит по месяцам; выгрузка /api/export читает из него только нужные месяцы
+
+Запуск по расписанию (cron):
+    30 3 * * * cd /path/to/app && venv/bin/python archive.py
+"""
+
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+# Фоновые задачи веб-приложения в скрипте не нужны
+os.environ.setdefault('SLA_ENABLED', 'false')
+
+from app import config, ticket_store, ticket_archive, tenant_registry, logger
+
+def archive_tenant(tenant, cutoff, dry_run=False):
+    """Перенос выполненных заявок клиента старше cutoff; возвращает число заявок по месяцам"""
+    # Открытые заявки остаются в журнале: их меняют диспетчеры и контролирует SLA
+    status = config.TICKET_STATUSES[-1]
+    partitions = {}
+    for partition, count in ticket_store.archive_months(tenant.id, status, cutoff):
+        if dry_run:
+            partitions[partition] = count
+            continue
+
+        # Каждый месяц переносится отдельной транзакцией: заявки удаляются из журнала
+        # только вместе с записью сегмента, поэтому сбой на следующем месяце
+        # не приводит к повторному архивированию уже перенесённых
+        month_start = datetime.strptime(partition, '%Y-%m')
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        segments = []
+        try:
+            partitions[partition] = ticket_store.move_tickets(
+                tenant.id, status, month_start, min(month_end, cutoff),
+                lambda tickets: segments.append(ticket_archive.write_segment(tenant.id, partition, tickets)))
+        except Exception:
+            # Журнал не изменился - сегмент, если он успел появиться, задвоил бы заявки
+            for base in segments:
+                ticket_archive.remove_segment(base)
+            raise
+        logger.info(f"Archived {partitions[partition]} tickets of {tenant.id} into {partition}")
+    return partitions
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос старых выполненных заявок в сжатый архив')
+    parser.add_argument('--tenant', help='архивировать только эту организацию')
+    parser.add_argument('--days', type=int, default=config.ARCHIVE_AFTER_DAYS,
+                        help='архивировать заявки старше N дней')
+    parser.add_argument('--dry-run', action='store_true', help='только показать, что будет перенесено')
+    parser.add_argument('--vacuum', action='store_true', help='сжать файл журнала после переноса')
+    args = parser.parse_args()
+
+    if args.tenant:
+        tenant = tenant_registry.get(args.tenant)
+        if tenant is None:
+            print(f"❌ Организация не найдена: {args.tenant}")
+            sys.exit(1)
+        tenants = [tenant]
+    else:
+        tenants = list(tenant_registry.tenants.values())
+
+    # Архивируем только полные дни
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=args.days), datetime.min.time())
+
+    print(f"🗄️ Архивирование заявок до {cutoff.strftime('%d.%m.%Y')}" +
+          (" (без изменений)" if args.dry_run else ""))
+    print("=" * 60)
+
+    total = 0
+    for tenant in tenants:
+        partitions = archive_tenant(tenant, cutoff, dry_run=args.dry_run)
+        count = sum(partitions.values())
+        total += count
+        print(f"\n📋 Организация: {tenant.id}")
+        print(f"   Перенесено заявок: {count}")
+        for partition, partition_count in partitions.items():
+            print(f"   {partition}: {partition_count}")
+
+    if args.vacuum and total and not args.dry_run:
+        ticket_store.vacuum()
+        print("\n✅ Файл журнала сжат")
+
+if __name__ == "__main__":
+    main()
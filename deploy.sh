@@ -160,7 +160,7 @@ User=$USER
 Group=$USER
 WorkingDirectory=$CURRENT_DIR
 Environment=PATH=$CURRENT_DIR/venv/bin
-ExecStart=$CURRENT_DIR/venv/bin/gunicorn -w 4 -b 127.0.0.1:8000 app:app
+ExecStart=$CURRENT_DIR/venv/bin/gunicorn -w 4 -k gthread --threads 100 -b 127.0.0.1:8000 app:app
 ExecReload=/bin/kill -s HUP \$MAINPID
 Restart=always
 
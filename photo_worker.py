@@ -0,0 +1,23 @@
+"""
+Обработка фото к заявкам в отдельных процессах
+Модуль не зависит от app.py: процессы пула загружают только его, а не всё приложение
+"""
+
+import os
+
+from PIL import Image, ImageOps
+
+def process_photo(source_path, target_path, max_size, quality):
+    """Уменьшение фото, удаление EXIF и пересжатие в JPEG.
+
+    Выполняется в отдельном процессе, чтобы декодирование больших фото
+    не занимало память и CPU рабочего процесса веб-сервера.
+    """
+    with Image.open(source_path) as image:
+        image.draft('RGB', (max_size, max_size))  # для JPEG декодируем сразу в уменьшенном масштабе
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        tmp_path = f"{target_path}.tmp"
+        # EXIF не передаём в save - метаданные в итоговый файл не попадают
+        image.convert('RGB').save(tmp_path, 'JPEG', quality=quality, optimize=True)
+    os.replace(tmp_path, target_path)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Сверка локального журнала заявок с Google Sheets и Telegram
+Находит заявки, которые не попали в таблицу или в Telegram, и отправляет их повторно,
+переносит в журнал статусы, выставленные диспетчерами в таблице
+
+Запуск по расписанию (cron):
+    */15 * * * * cd /path/to/app && venv/bin/python reconcile.py
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Фоновые задачи веб-приложения в скрипте не нужны
+os.environ.setdefault('SLA_ENABLED', 'false')
+
+from app import (config, ticket_store, tenant_registry, integration_pool,
+                 format_ticket_message, ticket_status_changed, logger)
+
+WATERMARK = 'reconcile'
+
+def row_key(date, time, building, floor, room_type, number, problem_type, description):
+    """Хэш-ключ заявки, одинаковый для строки таблицы и записи журнала"""
+    raw = '\x1f'.join(str(value or '').strip() for value in
+                      (date, time, building, floor, room_type, number, problem_type, description))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).digest()
+
+def ticket_key(ticket):
+    return row_key(ticket['date'], ticket['time'], ticket['building'], ticket['floor'],
+                   ticket['room_type'], ticket['room_number'], ticket['problem_type'],
+                   ticket['description'])
+
+def sheet_key(values):
+    values = list(values[:8]) + [''] * (8 - len(values))
+    return row_key(*values)
+
+def sheet_status(values):
+    """Статус из колонки «Статус» (I), None если значение не из списка статусов"""
+    value = values[8].strip() if len(values) > 8 else ''
+    return value if value in config.TICKET_STATUSES else None
+
+def parse_row_datetime(values):
+    """Дата и время заявки из строки таблицы"""
+    try:
+        return datetime.strptime(f"{values[0]} {values[1]}", '%d.%m.%Y %H:%M:%S')
+    except (IndexError, ValueError):
+        return None
+
+def ticket_request_data(ticket, base_url):
+    """Данные заявки из журнала в формате submit_request"""
+    return {
+        'room': {
+            'building': ticket['building'],
+            'floor': ticket['floor'],
+            'type': ticket['room_type'],
+            'number': ticket['room_number']
+        },
+        'problem_type': ticket['problem_type'],
+        'description': ticket['description'],
+        'date': ticket['date'],
+        'time': ticket['time'],
+        'photo_url': f"{base_url}/photos/{ticket['photo']}.jpg" if ticket['photo'] else ''
+    }
+
+class Reconciler:
+    """Сверка заявок одного клиента, начиная с сохранённой отметки (watermark)"""
+
+    def __init__(self, store, tenant, integrations, grace_minutes=5, telegram_limit=50,
+                 status_days=7, page_size=1000, pages_per_call=5, dry_run=False):
+        self.store = store
+        self.tenant = tenant
+        self.integrations = integrations
+        self.grace = timedelta(minutes=grace_minutes)
+        self.telegram_limit = telegram_limit
+        self.status_days = status_days
+        self.page_size = page_size
+        self.pages_per_call = pages_per_call
+        self.dry_run = dry_run
+        self.base_url = tenant.base_url or config.BASE_URL.rstrip('/')
+
+    def run(self, full=False):
+        report = {
+            'tenant': self.tenant.id,
+            'dry_run': self.dry_run,
+            'checked_tickets': 0,
+            'sheet_rows_scanned': 0,
+            'missing_in_sheet': [],
+            'missing_in_telegram': [],
+            'unknown_in_sheet': [],
+            'resent_to_sheet': 0,
+            'resent_to_telegram': 0,
+            'status_changes': [],
+            'status_synced': 0
+        }
+        watermark = 0 if full else self.store.get_watermark(WATERMARK, self.tenant.id)
+        report['watermark_from'] = report['watermark_to'] = watermark
+        cutoff = datetime.now() - self.grace
+
+        # Окно сверки: от первой непроверенной заявки до заявок, которые
+        # ещё могут быть в процессе отправки
+        first = self.store.first_ticket_after(watermark, self.tenant.id)
+        window_start = cutoff
+        if first is not None:
+            window_start = datetime.fromisoformat(first['created_at']).replace(microsecond=0)
+
+        # Статусы диспетчеры меняют в таблице, поэтому для незакрытых заявок за
+        # последние status_days дней (с --full - за всё время) таблица читается
+        # глубже окна сверки
+        oldest_open = self.store.oldest_open_ticket(
+            self.tenant.id, config.TICKET_STATUSES[-1],
+            None if full else cutoff - timedelta(days=self.status_days))
+        scan_start = window_start
+        if oldest_open is not None:
+            scan_start = min(scan_start, datetime.fromisoformat(oldest_open['created_at']).replace(microsecond=0))
+        if scan_start >= cutoff:
+            return report
+
+        # Журнал: хэш-ключ -> (номер заявки, статус в таблице, в окне сверки)
+        journal = defaultdict(list)
+        last_id = watermark
+        for rows in self.store.iter_tickets(date_from=scan_start, date_to=cutoff,
+                                            tenant=self.tenant.id):
+            for ticket in rows:
+                in_window = ticket['created_at'] >= window_start.isoformat()
+                journal[ticket_key(ticket)].append((ticket['id'], ticket['sheet_status'], in_window))
+                if not in_window:
+                    continue
+                report['checked_tickets'] += 1
+                if not ticket['telegram_sent'] and ticket['id'] > watermark:
+                    report['missing_in_telegram'].append(ticket['id'])
+                last_id = max(last_id, ticket['id'])
+        if not journal:
+            return report
+
+        try:
+            sheet_rows = self._scan_sheet(journal, window_start, scan_start, cutoff, report)
+        except Exception as e:
+            logger.error(f"Failed to read Google Sheet for tenant {self.tenant.id}: {e}")
+            report['error'] = str(e)
+            return report
+
+        report['missing_in_sheet'] = sorted(ticket_id for entries in journal.values()
+                                            for ticket_id, _, in_window in entries if in_window)
+        if self.dry_run:
+            return report
+
+        self._sync_statuses(report['status_changes'], report)
+        unresolved = self._resend_to_sheet(report['missing_in_sheet'], sheet_rows, report)
+        unresolved += self._resend_to_telegram(report['missing_in_telegram'], report)
+
+        # Отметку сдвигаем только до первой заявки, которую не удалось отправить
+        new_watermark = min(unresolved) - 1 if unresolved else last_id
+        if new_watermark > watermark:
+            self.store.set_watermark(WATERMARK, self.tenant.id, new_watermark)
+            report['watermark_to'] = new_watermark
+        return report
+
+    def _scan_sheet(self, journal, window_start, scan_start, cutoff, report):
+        """Чтение таблицы страницами, пока не начнутся строки старше scan_start.
+
+        Строки из окна сверки без заявки в журнале попадают в отчёт; для
+        найденных заявок запоминается статус, если его изменили в таблице.
+        Возвращает прочитанные строки (номер строки, время заявки) - по ним
+        выбирается место для повторно отправленных заявок.
+        """
+        sheet_rows = []
+        last_row = 1  # строка заголовков
+        pages = self.integrations.google_sheets.iter_rows(self.page_size, self.pages_per_call)
+        try:
+            for page in pages:
+                older = 0
+                for row_number, values in page:
+                    report['sheet_rows_scanned'] += 1
+                    last_row = row_number
+                    row_time = parse_row_datetime(values)
+                    if row_time is not None:
+                        sheet_rows.append((row_number, row_time))
+                    if row_time is None or row_time >= cutoff:
+                        continue
+                    if row_time < scan_start:
+                        older += 1
+                        continue
+                    entries = journal.get(sheet_key(values))
+                    if not entries:
+                        if row_time >= window_start:
+                            report['unknown_in_sheet'].append(row_number)
+                        continue
+                    ticket_id, known_status, _ = entries.pop()
+                    # Сравниваем с тем, что было в таблице при прошлой сверке, а не со
+                    # статусом журнала: иначе смена статуса на панели откатывалась бы
+                    status = sheet_status(values)
+                    if status is not None and status != known_status:
+                        report['status_changes'].append({'id': ticket_id, 'status': status})
+                # Новые строки вставляются сверху: страница целиком старше окна - дальше не читаем
+                if older == len(page):
+                    break
+        finally:
+            pages.close()
+        sheet_rows.append((last_row + 1, None))  # после последней прочитанной строки
+        return sheet_rows
+
+    def _sync_statuses(self, changes, report):
+        """Перенос в журнал статусов, изменённых в таблице"""
+        for change in changes:
+            ticket = self.store.set_sheet_status(change['id'], change['status'])
+            if ticket is None:
+                continue
+            if ticket['status'] != change['status']:
+                ticket_status_changed(self.tenant.id, ticket, change['status'])
+                report['status_synced'] += 1
+
+    def _resend_to_sheet(self, ticket_ids, sheet_rows, report, batch_size=500):
+        """Повторная запись заявок на их место по времени.
+
+        Таблица идёт от новых заявок к старым (новые вставляются во вторую
+        строку), и на этом держится ранняя остановка чтения в _scan_sheet.
+        Поэтому старые заявки вставляются не наверх, а перед первой строкой,
+        которая старше заявки.
+        """
+        tickets = []
+        for i in range(0, len(ticket_ids), batch_size):
+            tickets.extend(self.store.get_tickets(ticket_ids[i:i + batch_size]))
+        tickets.sort(key=lambda ticket: (ticket['created_at'], ticket['id']), reverse=True)
+
+        # Строка вставки -> заявки от новых к старым
+        groups = defaultdict(list)
+        position = 0
+        for ticket in tickets:
+            created_at = datetime.fromisoformat(ticket['created_at']).replace(microsecond=0)
+            while sheet_rows[position][1] is not None and sheet_rows[position][1] >= created_at:
+                position += 1
+            groups[sheet_rows[position][0]].append(ticket)
+
+        # Все группы вставляются одним запросом к API
+        requests_data = {row: [ticket_request_data(ticket, self.base_url) for ticket in group]
+                         for row, group in groups.items()}
+        ticket_ids = [ticket['id'] for ticket in tickets]
+        if not self.integrations.google_sheets.insert_requests(requests_data):
+            return ticket_ids
+        self.store.mark_delivered(ticket_ids, 'sheets_saved')
+        report['resent_to_sheet'] += len(ticket_ids)
+        return []
+
+    def _resend_to_telegram(self, ticket_ids, report):
+        # Не заваливаем чат: за один запуск не больше telegram_limit сообщений
+        unresolved = list(ticket_ids[self.telegram_limit:])
+        delivered = []
+        for ticket in self.store.get_tickets(ticket_ids[:self.telegram_limit]):
+            message = format_ticket_message(ticket_request_data(ticket, self.base_url),
+                                            title='🔁 <b>Повторная отправка заявки</b>')
+            if self.integrations.telegram_bot.send_message(message):
+                delivered.append(ticket['id'])
+            else:
+                unresolved.append(ticket['id'])
+        self.store.mark_delivered(delivered, 'telegram_sent')
+        report['resent_to_telegram'] += len(delivered)
+        return unresolved
+
+def print_report(report):
+    print(f"\n📋 Организация: {report['tenant']}" + (" (без изменений)" if report['dry_run'] else ""))
+    print(f"   Проверено заявок в журнале: {report['checked_tickets']}")
+    print(f"   Прочитано строк таблицы: {report['sheet_rows_scanned']}")
+    if 'error' in report:
+        print(f"❌ Ошибка чтения таблицы: {report['error']}")
+        return
+    print(f"   Нет в таблице: {len(report['missing_in_sheet'])}, отправлено повторно: {report['resent_to_sheet']}")
+    print(f"   Нет в Telegram: {len(report['missing_in_telegram'])}, отправлено повторно: {report['resent_to_telegram']}")
+    print(f"   Статус изменён в таблице: {len(report['status_changes'])}, перенесено в журнал: {report['status_synced']}")
+    if report['unknown_in_sheet']:
+        print(f"⚠️ Строки таблицы без заявки в журнале: {report['unknown_in_sheet']}")
+    print(f"   Отметка: {report['watermark_from']} → {report['watermark_to']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка журнала заявок с Google Sheets и Telegram')
+    parser.add_argument('--tenant', help='проверить только эту организацию')
+    parser.add_argument('--full', action='store_true', help='проверить весь журнал, а не только новые заявки')
+    parser.add_argument('--dry-run', action='store_true', help='только отчёт, без повторной отправки')
+    parser.add_argument('--report', help='сохранить отчёт в JSON-файл')
+    parser.add_argument('--grace-minutes', type=int, default=5,
+                        help='не проверять заявки моложе N минут (ещё отправляются)')
+    parser.add_argument('--telegram-limit', type=int, default=50,
+                        help='максимум повторных сообщений в Telegram за запуск')
+    parser.add_argument('--status-days', type=int, default=7,
+                        help='переносить статусы из таблицы для незакрытых заявок за последние N дней')
+    args = parser.parse_args()
+
+    if args.tenant:
+        tenant = tenant_registry.get(args.tenant)
+        if tenant is None:
+            print(f"❌ Организация не найдена: {args.tenant}")
+            sys.exit(1)
+        tenants = [tenant]
+    else:
+        tenants = list(tenant_registry.tenants.values())
+
+    print("🔍 Сверка журнала заявок с Google Sheets и Telegram")
+    print("=" * 60)
+
+    reports = []
+    for tenant in tenants:
+        reconciler = Reconciler(ticket_store, tenant, integration_pool.get(tenant),
+                                grace_minutes=args.grace_minutes,
+                                telegram_limit=args.telegram_limit,
+                                status_days=args.status_days,
+                                dry_run=args.dry_run)
+        report = reconciler.run(full=args.full)
+        print_report(report)
+        reports.append(report)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Отчёт сохранён в {args.report}")
+
+    if any('error' in report for report in reports):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
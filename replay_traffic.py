@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанного трафика на тестовом стенде
+Запросы отправляются с исходными интервалами (ускорение 1×–50×). Время
+обработки на стенде (заголовок Server-Timing) сравнивается с записью или с
+отчётом предыдущего прогона; время у клиента (сеть и очереди) есть только
+в отчётах прогонов, его сравнение требует --baseline
+
+Запись на рабочем сервере (.env):
+    CAPTURE_FILE=traffic.log
+    CAPTURE_SALT=любая-строка
+
+Стенд запускается с заглушками Telegram и Google Sheets:
+    STANDIN_INTEGRATIONS=true gunicorn -w 4 -k gthread --threads 100 app:app
+
+Запуск:
+    python replay_traffic.py traffic.log --target http://staging:5000 --speed 10
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from io import BytesIO
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+MIN_SPEED, MAX_SPEED = 1, 50
+FILLER = 'Тестовая заявка. '
+
+def load_capture(path):
+    """Записи из файла трафика по времени прихода"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f"⚠️ Пропущена повреждённая строка {line_number}")
+    records.sort(key=lambda record: record['t'])
+    return records
+
+def percentile(values, share):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+def latency_stats(values):
+    return {
+        'p50_ms': percentile(values, 0.5),
+        'p95_ms': percentile(values, 0.95),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': max(values) if values else None
+    }
+
+def summarize(results):
+    """Сводка по эндпоинтам: число запросов, ошибки, отказы (503), время на сервере и у клиента"""
+    groups = defaultdict(list)
+    for endpoint, status, client_ms, server_ms in results:
+        groups[endpoint].append((status, client_ms, server_ms))
+    summary = {}
+    for endpoint, items in sorted(groups.items()):
+        succeeded = [item for item in items if item[0] and item[0] < 500]
+        summary[endpoint] = {
+            'requests': len(items),
+            'errors': sum(1 for status, _, _ in items if status is None or (status >= 500 and status != 503)),
+            'shed': sum(1 for status, _, _ in items if status == 503),
+            'server': latency_stats([server for _, _, server in succeeded if server is not None]),
+            'client': latency_stats([client for _, client, _ in succeeded if client is not None])
+        }
+    return summary
+
+def server_time(response):
+    """Время обработки на стенде из заголовка Server-Timing (app;dur=...)"""
+    for metric in response.headers.get('Server-Timing', '').split(','):
+        name, _, params = metric.strip().partition(';')
+        if name == 'app' and params.startswith('dur='):
+            try:
+                return float(params[len('dur='):])
+            except ValueError:
+                return None
+    return None
+
+class TrafficReplayer:
+    """Отправка записанных запросов на стенд с исходными интервалами"""
+
+    def __init__(self, target, speed, workers=200, timeout=60):
+        self.target = target.rstrip('/')
+        self.speed = speed
+        self.timeout = timeout
+        self.workers = workers
+        self.rooms = {}    # хэш помещения -> условный номер
+        self.photos = {}   # размер (в блоках по 64 КБ) -> JPEG
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.results = []
+        self.max_lag_ms = 0
+        self.duration = 0
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _room(self, token):
+        # Одно и то же помещение в записи - одно и то же помещение на стенде
+        with self._lock:
+            number = self.rooms.setdefault(token, len(self.rooms) + 1)
+        return {'building': 'A', 'floor': '1', 'type': 'Туалет', 'number': str(number)}
+
+    def _photo(self, size):
+        """JPEG примерно заданного размера (шум плохо сжимается)"""
+        bucket = max(1, size // 65536)
+        with self._lock:
+            photo = self.photos.get(bucket)
+        if photo is None:
+            side = max(64, int(math.sqrt(bucket * 65536)))
+            buffer = BytesIO()
+            Image.effect_noise((side, side), 64).convert('RGB').save(buffer, 'JPEG', quality=85)
+            photo = buffer.getvalue()
+            with self._lock:
+                self.photos[bucket] = photo
+        return photo
+
+    def _send(self, record):
+        session = self._session()
+        url = f"{self.target}/api/generate_qr/{self._room(record.get('r'))['number']}"
+        if record['e'] == 'submit':
+            url = f"{self.target}/api/submit_request"
+            room = self._room(record.get('r'))
+            problem = record.get('p') if record.get('p') != 'custom' else 'other'
+            description = (FILLER * (record.get('dl', 0) // len(FILLER) + 1))[:record.get('dl', 0)]
+            if record.get('ph'):
+                files = {'photo': ('photo.jpg', self._photo(record.get('b', 0)), 'image/jpeg')}
+                data = {'room': json.dumps(room, ensure_ascii=False), 'problem_type': problem,
+                        'description': description}
+                return session.post(url, data=data, files=files, timeout=self.timeout)
+            return session.post(url, json={'room': room, 'problem_type': problem,
+                                           'description': description}, timeout=self.timeout)
+        return session.get(url, timeout=self.timeout)
+
+    def _run_one(self, record):
+        started = time.perf_counter()
+        try:
+            response = self._send(record)
+            status, server_ms = response.status_code, server_time(response)
+        except requests.RequestException:
+            status, server_ms = None, None
+        client_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.results.append((record['e'], status, client_ms, server_ms))
+
+    def run(self, records):
+        if not records:
+            return
+        first = records[0]['t']
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for record in records:
+                due = start + (record['t'] - first) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Отставание самого скрипта от расписания
+                    self.max_lag_ms = max(self.max_lag_ms, -delay * 1000)
+                pool.submit(self._run_one, record)
+        self.duration = time.monotonic() - start
+
+def baseline_from_capture(records):
+    # В записи есть только время обработки на сервере, времени у клиента нет
+    return summarize([(record['e'], record['s'], None, record['ms']) for record in records])
+
+def format_ms(value):
+    return '—' if value is None else f"{value:.0f}"
+
+def print_latency(title, current, base):
+    print(f"   {title}")
+    print(f"   {'':8}{'стенд':>10}{'база':>10}{'разница':>10}")
+    for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+        delta = (f"{current[key] - base[key]:+.0f}"
+                 if current[key] is not None and base.get(key) is not None else '—')
+        print(f"   {key[:-3]:8}{format_ms(current[key]):>10}{format_ms(base.get(key)):>10}{delta:>10}")
+
+def print_comparison(summary, baseline):
+    for endpoint, current in summary.items():
+        base = baseline.get(endpoint, {})
+        print(f"\n📈 {endpoint}: {current['requests']} запросов "
+              f"(в базовом прогоне {base.get('requests', 0)})")
+        if current['server']['max_ms'] is None:
+            print("   ⚠️ Стенд не передаёт Server-Timing, время на сервере не сравнивается")
+        print_latency('время на сервере, мс:', current['server'], base.get('server', {}))
+        print_latency('время у клиента (сеть и очереди), мс:', current['client'], base.get('client', {}))
+        print(f"   ошибки: {current['errors']} (база {base.get('errors', 0)}), "
+              f"отказы 503: {current['shed']} (база {base.get('shed', 0)})")
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика на тестовом стенде')
+    parser.add_argument('capture', help='файл записи (CAPTURE_FILE)')
+    parser.add_argument('--target', default='http://localhost:5000', help='адрес тестового стенда')
+    parser.add_argument('--speed', type=float, default=1, help=f'ускорение, {MIN_SPEED}–{MAX_SPEED}')
+    parser.add_argument('--baseline', help='сравнить с отчётом предыдущего прогона вместо записи '
+                                           '(нужно для сравнения времени у клиента)')
+    parser.add_argument('--report', help='сохранить отчёт в JSON-файл')
+    parser.add_argument('--workers', type=int, default=200, help='максимум одновременных запросов')
+    parser.add_argument('--limit', type=int, help='воспроизвести только первые N запросов')
+    args = parser.parse_args()
+
+    if not MIN_SPEED <= args.speed <= MAX_SPEED:
+        print(f"❌ Ускорение должно быть от {MIN_SPEED} до {MAX_SPEED}")
+        sys.exit(1)
+
+    records = load_capture(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("❌ В записи нет запросов")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['summary']
+    else:
+        baseline = baseline_from_capture(records)
+
+    span = records[-1]['t'] - records[0]['t']
+    print(f"▶️ Воспроизведение {len(records)} запросов на {args.target} (×{args.speed:g}, "
+          f"~{span / args.speed:.0f} с)")
+    print("=" * 60)
+
+    replayer = TrafficReplayer(args.target, args.speed, workers=args.workers)
+    replayer.run(records)
+    summary = summarize(replayer.results)
+
+    print(f"\n⏱️ Длительность: {replayer.duration:.1f} с, "
+          f"макс. отставание от расписания: {replayer.max_lag_ms:.0f} мс")
+    print_comparison(summary, baseline)
+
+    if args.report:
+        report = {
+            'capture': args.capture,
+            'target': args.target,
+            'speed': args.speed,
+            'duration_s': round(replayer.duration, 1),
+            'max_lag_ms': round(replayer.max_lag_ms),
+            'summary': summary,
+            'baseline': baseline
+        }
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Отчёт сохранён в {args.report}")
+
+    if any(item['errors'] for item in summary.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -62,12 +62,12 @@ def create_spreadsheet(client, title="Система учета проблем")
         # Добавляем заголовки
         headers = [
             'Дата', 'Время', 'Корпус', 'Этаж', 'Тип помещения', 
-            'Номер', 'Проблема', 'Описание', 'Статус'
+            'Номер', 'Проблема', 'Описание', 'Статус', 'Фото'
         ]
         worksheet.insert_row(headers, 1)
         
         # Форматируем заголовки
-        worksheet.format('A1:I1', {
+        worksheet.format('A1:J1', {
             'backgroundColor': {'red': 0.2, 'green': 0.4, 'blue': 0.9},
             'textFormat': {'foregroundColor': {'red': 1.0, 'green': 1.0, 'blue': 1.0}, 'bold': True}
         })